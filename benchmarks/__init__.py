@@ -0,0 +1,77 @@
+"""Benchmarks of vMars, on real workloads.
+
+Run them all with `python -m benchmarks` from the root of the repository
+(see `python -m benchmarks --help`). To gate a change, store the results
+of the previous version with `-o baseline.json`, and run the new one with
+`-b baseline.json` on the same machine (see the README). Each module has a list of
+`(name, unit, function)` BENCHMARKS, where `function(scale)` returns a
+rate: higher is better."""
+
+from __future__ import print_function
+
+import sys
+import time
+import platform
+
+MODULES = ['instructions', 'steps', 'battles', 'assembly', 'loading',
+           'memoryview']
+
+# Benchmarks needing these modules are skipped if they are not installed.
+OPTIONAL_DEPENDENCIES = ('PyQt4', 'numpy')
+
+class Skip(Exception):
+    """Raised by a benchmark which cannot run in this environment."""
+
+def _missing_dependency(error):
+    """Returns whether an ImportError is caused by a missing optional
+    dependency (any other import error is a bug)."""
+    name = getattr(error, 'name', None) or str(error).split()[-1]
+    return name.split('.')[0] in OPTIONAL_DEPENDENCIES
+
+def benchmarks(modules=MODULES):
+    """Yields (name, unit, function) for the benchmarks of the modules
+    whose dependencies are installed."""
+    for name in modules:
+        try:
+            module = __import__('benchmarks.' + name, fromlist=['BENCHMARKS'])
+        except ImportError as e:
+            if not _missing_dependency(e):
+                raise
+            print('Skipping %s: %s' % (name, e), file=sys.stderr)
+            continue
+        for benchmark in module.BENCHMARKS:
+            yield benchmark
+
+def run(patterns=(), scale=1.0, repeat=3):
+    """Runs the benchmarks whose name contains one of the `patterns` (all
+    of them if none is given), keeps the best of `repeat` runs, and returns
+    the results as a dict which can be dumped as JSON."""
+    results = {}
+    for (name, unit, function) in benchmarks():
+        if patterns and not any([x in name for x in patterns]):
+            continue
+        try:
+            value = max([function(scale) for i in range(0, repeat)])
+        except Skip as e:
+            print('Skipping %s: %s' % (name, e), file=sys.stderr)
+            continue
+        print('%-45s %12.1f %s' % (name, value, unit), file=sys.stderr)
+        results[name] = {'value': value, 'unit': unit}
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'time': time.time(),
+            'scale': scale,
+            'results': results}
+
+def compare(results, baseline, tolerance=0.1):
+    """Returns the list of (name, value, baseline value) of the
+    benchmarks which are more than `tolerance` slower than the
+    baseline."""
+    regressions = []
+    for (name, result) in sorted(results['results'].items()):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['value']
+        if result['value'] < old * (1 - tolerance):
+            regressions.append((name, result['value'], old))
+    return regressions
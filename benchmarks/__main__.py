@@ -0,0 +1,47 @@
+"""Runs the benchmarks, writes the results as JSON, and compares them
+with a baseline."""
+
+from __future__ import print_function
+
+import sys
+import json
+import argparse
+
+from benchmarks import run, compare
+
+parser = argparse.ArgumentParser(prog='python -m benchmarks',
+        description='Runs the vMars benchmarks.')
+parser.add_argument('patterns', nargs='*', metavar='pattern',
+        help='only run the benchmarks whose name contains one of these')
+parser.add_argument('--output', '-o', default='-',
+        help='file where the results are written as JSON '
+        '(- for the standard output, which is the default)')
+parser.add_argument('--baseline', '-b', default=None,
+        help='results of a previous run; exits with status 1 if a '
+        'benchmark is slower than the baseline')
+parser.add_argument('--tolerance', '-t', default=0.1, type=float,
+        help='relative slowdown tolerated by --baseline (default: 0.1)')
+parser.add_argument('--scale', '-s', default=1.0, type=float,
+        help='size of the workloads (default: 1.0)')
+parser.add_argument('--repeat', '-r', default=3, type=int,
+        help='number of runs of each benchmark, the best one is kept '
+        '(default: 3)')
+args = parser.parse_args()
+
+results = run(args.patterns, args.scale, args.repeat)
+output = json.dumps(results, indent=4, sort_keys=True)
+if args.output == '-':
+    print(output)
+else:
+    with open(args.output, 'w') as fd:
+        fd.write(output + '\n')
+
+if args.baseline is not None:
+    with open(args.baseline) as fd:
+        baseline = json.load(fd)
+    regressions = compare(results, baseline, args.tolerance)
+    for (name, value, old) in regressions:
+        print('Regression: %s %.1f -> %.1f (%+.1f%%)' %
+                (name, old, value, 100.*(value-old)/old), file=sys.stderr)
+    if regressions:
+        sys.exit(1)
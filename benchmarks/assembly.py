@@ -0,0 +1,18 @@
+"""Measures the assembly of large generated sources."""
+
+import time
+
+from vmars import core
+from vmars import assembler
+
+from benchmarks.warriors import assembly
+
+def lines_per_second(lines):
+    source = assembly(lines)
+    assembler_ = assembler.Assembler(core.MarsProperties())
+    start = time.time()
+    assembler_.assemble(source)
+    return source.count('\n') / (time.time() - start)
+
+BENCHMARKS = [('assembly.assemble', 'lines/s',
+               lambda scale: lines_per_second(int(8000*scale)))]
@@ -0,0 +1,29 @@
+"""Measures full battles between two warriors, run with Mars.cycle."""
+
+import time
+
+from vmars import core
+
+from benchmarks.warriors import WARRIORS, BATTLES
+
+def battles_per_second(programs, battles, cycles,
+        memory_class=core.Memory):
+    properties = core.MarsProperties(maxcycles=cycles)
+    start = time.time()
+    for i in range(0, battles):
+        mars = core.Mars(properties, memory_class)
+        for (j, program) in enumerate(programs):
+            mars.load(core.Warrior(program), j*4000)
+        while len(mars.warriors) > 1 and mars.cycles < cycles:
+            mars.cycle()
+    return battles / (time.time() - start)
+
+def _benchmark(programs, memory_class):
+    return lambda scale: battles_per_second(programs, 3,
+                                            int(4000*scale), memory_class)
+
+BENCHMARKS = [('battles.%s.%s' % (memory_class.__name__, '-'.join(names)),
+               'battles/s',
+               _benchmark([WARRIORS[x] for x in names], memory_class))
+              for memory_class in (core.Memory, core.ArrayMemory)
+              for names in BATTLES]
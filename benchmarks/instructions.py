@@ -0,0 +1,42 @@
+"""Measures the raw throughput of Instruction.run, outside of any Mars."""
+
+import time
+
+from vmars import core
+
+if 'xrange' not in globals(): # Python 3
+    xrange = range
+
+INSTRUCTIONS = {'mov': 'MOV.I $0, $1',
+                'add': 'ADD.AB #4, $3',
+                'djn': 'DJN.B $0, #10',
+                'postincrement': 'MOV.I }1, >1',
+                'cmp': 'CMP.I $1, $2',
+                'seq': 'SEQ.F $1, $2',
+                'sne': 'SNE.X $1, $2',
+                'slt': 'SLT.AB #4, $2'}
+
+def runs_per_second(instruction, runs, memory_class=core.Memory):
+    memory = memory_class(8000)
+    instruction = core.Instruction.from_string(instruction)
+    ptrs = range(0, 8000, 10)
+    for ptr in ptrs:
+        memory.write(ptr, instruction.copy())
+    runs = len(ptrs) * max(1, runs // len(ptrs))
+    with memory.fast_path():
+        start = time.time()
+        for i in xrange(0, runs // len(ptrs)):
+            for ptr in ptrs:
+                # Without strict checks, as in Mars.run_battle
+                memory.read(ptr).run(memory, ptr, False)
+        duration = time.time() - start
+    return runs / duration
+
+def _benchmark(instruction, memory_class):
+    return lambda scale: runs_per_second(instruction, int(50000*scale),
+                                         memory_class)
+
+BENCHMARKS = [('instructions.%s.%s' % (memory_class.__name__, name),
+               'runs/s', _benchmark(INSTRUCTIONS[name], memory_class))
+              for memory_class in (core.Memory, core.ArrayMemory)
+              for name in sorted(INSTRUCTIONS)]
@@ -0,0 +1,36 @@
+"""Measures the parsing of load files into warriors."""
+
+import io
+import time
+
+from vmars import core
+
+from benchmarks.warriors import WARRIORS
+
+def _load_file(length):
+    return 'ORG 0\n' + '\n'.join([str(x) for x in
+        core.Warrior(WARRIORS['mice']).program * (length // 8)]) + '\n'
+
+def text_warriors_per_second(length):
+    load_file = _load_file(length)
+    start = time.time()
+    for i in range(0, 100):
+        core.Warrior(load_file)
+    return 100 / (time.time() - start)
+
+def binary_warriors_per_second(length):
+    fd = io.BytesIO()
+    core.dump_load_file(fd, core.Warrior(_load_file(length)).program)
+    load_file = fd.getvalue()
+    memory = core.ArrayMemory(8000)
+    start = time.time()
+    for i in range(0, 100):
+        memory.load(0, core.Warrior.from_binary(load_file))
+    return 100 / (time.time() - start)
+
+BENCHMARKS = [
+        ('loading.text', 'warriors/s',
+         lambda scale: text_warriors_per_second(int(100*scale))),
+        ('loading.binary', 'warriors/s',
+         lambda scale: binary_warriors_per_second(int(100*scale))),
+        ]
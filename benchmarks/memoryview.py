@@ -0,0 +1,32 @@
+"""Measures the painting of the memory view, without showing it."""
+
+import os
+import sys
+import time
+
+from PyQt4.QtGui import QApplication
+
+from vmars import core
+from vmars.qt.memoryview import MemoryView
+
+from benchmarks import Skip
+
+_application = None # Widgets need an application, which must outlive them
+
+def frames_per_second(frames):
+    global _application
+    if os.name == 'posix' and sys.platform != 'darwin' and \
+            not os.environ.get('DISPLAY'):
+        # Qt 4 has no offscreen platform: X11 is required.
+        raise Skip('no X display, run it under xvfb-run.')
+    _application = QApplication.instance() or QApplication(sys.argv)
+    memory = core.Memory(8000)
+    view = MemoryView(memory)
+    view.resizeEvent()
+    start = time.time()
+    for i in range(0, frames):
+        view.redraw() # Paints the whole memory
+    return frames / (time.time() - start)
+
+BENCHMARKS = [('memoryview.redraw', 'frames/s',
+               lambda scale: frames_per_second(max(1, int(10*scale))))]
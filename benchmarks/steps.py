@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""Measures how many steps per second the emulator runs, for a few
+warriors fighting alone in the core.
+
+Run with `python -m benchmarks.steps [cycles]`."""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from vmars import core
+
+from benchmarks.warriors import WARRIORS
+
+if 'xrange' not in globals(): # Python 3
+    xrange = range
+
+def steps_per_second(program, cycles, memory_class=core.Memory):
+    mars = core.Mars(core.MarsProperties(), memory_class)
+    mars.load(core.Warrior(program))
+    steps = 0
+    start = time.time()
+    for i in xrange(0, cycles):
+        if mars.warriors == []:
+            break
+        mars.cycle()
+        steps += 1
+    return steps / (time.time() - start)
+
+def _benchmark(program, memory_class):
+    return lambda scale: steps_per_second(program, int(20000*scale),
+                                          memory_class)
+
+BENCHMARKS = [('steps.%s.%s' % (memory_class.__name__, name), 'steps/s',
+               _benchmark(WARRIORS[name], memory_class))
+              for memory_class in (core.Memory, core.ArrayMemory)
+              for name in sorted(WARRIORS)]
+
+def main(cycles=20000):
+    for memory_class in (core.Memory, core.ArrayMemory):
+        for name in sorted(WARRIORS):
+            print('%s\t%s\t%i steps/s' % (memory_class.__name__, name,
+                steps_per_second(WARRIORS[name], cycles, memory_class)))
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
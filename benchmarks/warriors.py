@@ -0,0 +1,47 @@
+"""Warriors and assembly sources used by the benchmarks."""
+
+WARRIORS = {
+    'imp': 'MOV 0, 1',
+    'dwarf': '''ADD.AB #4, 3
+                MOV.I  2, @2
+                JMP    -2
+                DAT    #0, #0''',
+    # Mice, by Chip Wendell: a SPL/MOV paper (replicator)
+    'mice': '''ORG 1
+               DAT    #0, #0
+               MOV    #12, -1
+               MOV    @-2, <5
+               DJN    -1, -3
+               SPL    @3
+               ADD    #653, 2
+               JMZ    -5, -6
+               DAT    #0, #833''',
+    # A B-scanner: bombs the first non-empty cell it finds
+    'scanner': '''ADD.AB #5, 3
+                  JMZ.F  -1, @2
+                  MOV.I  2, @1
+                  JMP    -3, #5
+                  DAT    #0, #0''',
+    }
+
+# Pairs of warriors for full battles
+BATTLES = [('imp', 'dwarf'), ('mice', 'scanner'), ('dwarf', 'scanner'),
+           ('mice', 'dwarf')]
+
+def assembly(lines):
+    """Returns a generated assembly source of about `lines` lines, using
+    labels (backward and forward), EQU constants and expressions."""
+    source = ['step EQU 7',
+              'gap  EQU step*2+1',
+              ';name generated',
+              ';author benchmarks']
+    for i in range(0, lines//4):
+        source.extend([
+            'loop%i  ADD.AB #step, ptr%i' % (i, i),
+            '        MOV.I  bomb, @ptr%i' % i,
+            '        JMP    loop%i, <(gap-%i)%%8000' % ((i + 1), i),
+            'ptr%i   DAT    #0, #%i' % (i, i)])
+    source.append('loop%i JMP loop0' % (lines//4))
+    source.append('bomb DAT #0, #0')
+    source.append('END loop0')
+    return '\n'.join(source)
@@ -24,10 +24,18 @@
 
 from __future__ import print_function
 
-__all__ = ['Assembler', 'ParseError']
+__all__ = ['Assembler', 'AssemblyCache', 'AssemblyStream', 'ParseError',
+        'compile_expression', 'read_header']
 
+import os
 import re
-import core
+import hashlib
+import collections
+
+try:
+    from . import core
+except (ImportError, ValueError): # Not imported from the vmars package
+    import core
 
 class SYNTAX:
     addressing = '#$*@{}<>'
@@ -50,45 +58,335 @@ class ParseError(Exception):
     pass
 
 
+_token = re.compile(r'\s*(?:(?P<number>[0-9]+)|(?P<name>[A-Za-z_][A-Za-z0-9_]*)|'
+                    r'(?P<operator>[-+*/%()]))')
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _token.match(expression, position)
+        if match is None:
+            raise ParseError('`%s` is not a valid character.' %
+                    expression[position:].lstrip()[0])
+        position = match.end()
+        if match.group('number') is not None:
+            tokens.append(('number', int(match.group('number'))))
+        elif match.group('name') is not None:
+            tokens.append(('name', match.group('name')))
+        else:
+            tokens.append(('operator', match.group('operator')))
+    return tokens
+
+def _divide(a, b):
+    """Integer division, rounded towards zero."""
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+def _modulo(a, b):
+    return a - b * _divide(a, b)
+
+_binary_operators = {
+        '+': lambda a,b:a+b,
+        '-': lambda a,b:a-b,
+        '*': lambda a,b:a*b,
+        '/': _divide,
+        '%': _modulo,
+        }
+
+def compile_expression(expression, resolve):
+    """Compiles an arithmetic expression (integers, identifiers, + - * / %
+    and parentheses) into a function of the current line number.
+
+    `resolve` is called once per identifier, and returns the function
+    giving its value."""
+    tokens = _tokenize(expression)
+    position = [0]
+
+    def peek():
+        if position[0] < len(tokens):
+            return tokens[position[0]]
+        return (None, None)
+    def next_():
+        token = peek()
+        position[0] += 1
+        return token
+
+    def binary(operand, operators):
+        def parse():
+            left = operand()
+            while peek()[0] == 'operator' and peek()[1] in operators:
+                function = _binary_operators[next_()[1]]
+                right = operand()
+                left = (lambda left, right:
+                        lambda i: function(left(i), right(i)))(left, right)
+            return left
+        return parse
+
+    def unary():
+        (kind, value) = next_()
+        if kind == 'operator' and value == '-':
+            operand = unary()
+            return lambda i: -operand(i)
+        elif kind == 'operator' and value == '+':
+            return unary()
+        elif kind == 'operator' and value == '(':
+            operand = sum_()
+            if next_() != ('operator', ')'):
+                raise ParseError('`%s`: missing `)`.' % expression)
+            return operand
+        elif kind == 'number':
+            return lambda i: value
+        elif kind == 'name':
+            return resolve(value)
+        else:
+            raise ParseError('`%s` is not a valid expression.' % expression)
+
+    product = binary(unary, '*/%')
+    sum_ = binary(product, '+-')
+
+    function = sum_()
+    if position[0] != len(tokens):
+        raise ParseError('`%s` is not a valid expression.' % expression)
+    return function
+
+class AssemblyCache(object):
+    """Cache of assembled warriors, keyed by the hash of their source code
+    and the properties they were assembled with.
+
+    It keeps the `maxsize` most recently used warriors in memory, and, if
+    `directory` is given, also stores them there as load files."""
+    def __init__(self, maxsize=128, directory=None):
+        self._maxsize = maxsize
+        self._directory = directory
+        self._entries = collections.OrderedDict()
+
+    @staticmethod
+    def key(assembly, properties):
+        properties = sorted(properties.as_dict.items())
+        return hashlib.sha1(('%r\n%s' % (properties, assembly))
+                .encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + '.rc')
+
+    def get(self, key):
+        """Returns (origin, list of instructions), or None if the warrior
+        is not in the cache."""
+        if key in self._entries:
+            entry = self._entries.pop(key)
+        elif self._directory is not None and os.path.exists(self._path(key)):
+            with open(self._path(key)) as fd:
+                lines = fd.read().split('\n')
+            entry = (int(lines[0][len('ORG '):]),
+                     [core.Instruction.from_string(x) for x in lines[1:]
+                      if x != ''])
+        else:
+            return None
+        self._entries[key] = entry # Most recently used
+        self._trim()
+        return (entry[0], [x.copy() for x in entry[1]])
+
+    def set(self, key, origin, load):
+        entry = (origin, [x.copy() for x in load])
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        self._trim()
+        if self._directory is not None:
+            with open(self._path(key), 'w') as fd:
+                fd.write(Assembler.format_load(origin, load))
+
+    def _trim(self):
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class Assembler(object):
-    def __init__(self, properties):
+    def __init__(self, properties, cache=None):
         if not isinstance(properties, core.MarsProperties):
             raise ValueError('`properties` must be an instance of '
                     'core.MarsProperties, not %r' % properties)
         self._properties = properties
+        self._cache = cache
+
+    @staticmethod
+    def format_load(origin, load):
+        """Returns the load file of a list of instructions."""
+        return 'ORG %i\n' % origin + ''.join([str(x) + '\n' for x in load])
 
     def assemble(self, assembly, raw=False):
         if not isinstance(assembly, str):
             raise ValueError('The assembly code must be a string, not %r' %
                     assembly)
+        if self._cache is not None:
+            key = self._cache.key(assembly, self._properties)
+            cached = self._cache.get(key)
+            if cached is None:
+                cached = self._assemble(assembly)
+                self._cache.set(key, *cached)
+            (origin, load) = cached
+        else:
+            (origin, load) = self._assemble(assembly)
+        if raw:
+            return (origin, self.format_load(origin, load))
+        else:
+            return (origin, load)
+
+    def assemble_stream(self, fileobj, raw=False):
+        """Assembles an iterable of lines (typically a file object) in a
+        single pass, and returns an iterator over the instructions (or
+        load file lines, if `raw` is True) of the load file."""
+        return AssemblyStream(self._properties, fileobj, raw)
+
+    def dump_load_file(self, fd, fileobj):
+        """Assembles an iterable of lines (typically a file object) and
+        writes its binary load file to `fd` (see core.dump_load_file). The
+        assembly is streamed, unless the assembler has a cache. Both ways
+        write the same file."""
+        if self._cache is None:
+            core.dump_load_file(fd, self.assemble_stream(fileobj))
+            return
+        lines = list(fileobj)
+        (origin, load) = self.assemble(''.join(lines))
+        (name, author) = read_header(lines)
+        core.dump_load_file(fd, load, origin, name, author)
+
+    def _assemble(self, assembly):
+        stream = AssemblyStream(self._properties, assembly.split('\n'))
+        load = list(stream)
+        return (stream.origin, load)
+
+
+class _Unresolved(Exception):
+    """Raised when evaluating an expression referring to a name which is
+    not defined yet."""
+    pass
+
+def _header_comment(line):
+    """Returns (key, value) if `line` is a `;name` or `;author` comment
+    line, or None."""
+    if SYNTAX.comment_line.match(line):
+        comment = line.strip()
+        for key in ('name', 'author'):
+            if comment.startswith(';%s ' % key):
+                return (key, comment[len(key)+2:])
+    return None
+
+def read_header(lines):
+    """Returns the name and the author of an iterable of assembly lines,
+    read from their `;name` and `;author` comments, or None."""
+    header = {}
+    for line in lines:
+        comment = _header_comment(line.rstrip('\r\n'))
+        if comment is not None:
+            header[comment[0]] = comment[1]
+    return (header.get('name'), header.get('author'))
+
+class AssemblyStream(object):
+    """Iterator over the instructions of an assembly file.
 
-        def evaluate_operand(operand):
-            if operand is None or operand == '':
-                return None
-            addresser = operand[0] if operand[0] in SYNTAX.addressing else ''
-            operand = operand[len(addresser):]
-            for x in operand:
-                if x not in ('abcdefghijklmnopqrstuvwxyz'
-                        'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789+-*/%'):
-                    raise ParseError('On line %i: `%s` is not a valid '%(j,x)+
-                            'character')
-            context = self._properties.as_dict
-            context.update(constants)
-            context.update(dict([(x,y-i) for x,y in labels.items()]))
-            context.update(variables)
-            return addresser + str(eval(operand, context))
-
-
-        origin = 0
-        labels = {}
-        constants = {}
-        variables = {}
-        load_queue = []
+    Lines are consumed lazily. Instructions referring to names which are
+    not defined yet are put in a backpatch list, and are yielded (in order)
+    as soon as these names are defined. `origin` is set once the whole file
+    has been consumed; in raw mode, the `ORG` line is the last one. `name`
+    and `author` are read from the `;name` and `;author` comments."""
+    def __init__(self, properties, lines, raw=False):
+        self.origin = None
+        self.name = None
+        self.author = None
+        self._properties = properties.as_dict
+        self._properties.update([(x.upper(), y)
+                                 for (x, y) in self._properties.items()])
+        self._labels = {}
+        self._constants = {}
+        self._compiled_constants = {}
+        self._evaluating = set()
+        # Maps a name to the list of pending instructions waiting for it
+        self._waiting = collections.defaultdict(list)
+        self._iterator = self._assemble(lines, raw)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+    next = __next__
+
+    def _lookup(self, name):
+        """Returns a function of the current line giving the value of the
+        name, evaluated lazily."""
+        def lookup(i):
+            if name in self._labels:
+                return self._labels[name] - i
+            elif name in self._constants:
+                if name in self._evaluating:
+                    raise ParseError('`%s` is defined recursively.' % name)
+                if name not in self._compiled_constants:
+                    self._compiled_constants[name] = compile_expression(
+                            self._constants[name], self._lookup)
+                self._evaluating.add(name)
+                try:
+                    return self._compiled_constants[name](i)
+                finally:
+                    self._evaluating.remove(name)
+            elif name in self._properties:
+                return self._properties[name]
+            else:
+                raise _Unresolved(name)
+        return lookup
+
+    def _compile_operand(self, j, operand):
+        """Returns the addressing mode and a function of the current line
+        returning the value of the operand."""
+        if operand is None or operand == '':
+            return (core.DIRECT, lambda i: 0)
+        addresser = operand[0] if operand[0] in SYNTAX.addressing else '$'
+        if operand[0] in SYNTAX.addressing:
+            operand = operand[1:]
+        try:
+            return (SYNTAX.addressing.index(addresser),
+                    compile_expression(operand, self._lookup))
+        except ParseError as e:
+            raise ParseError('On line %i: %s' % (j, e.args[0]))
+
+    @staticmethod
+    def _evaluate(j, function, i):
+        try:
+            return function(i)
+        except ZeroDivisionError:
+            raise ParseError('On line %i: division by zero.' % j)
+
+    def _resolve(self, pending):
+        """Tries to build the instruction of a pending entry, and puts it
+        back in the backpatch list if a name is still missing."""
+        (j, i, opcode, modifier, A_mode, A, B_mode, B) = pending[0:8]
+        try:
+            pending[9] = core.Instruction.from_fields(opcode, modifier,
+                    A_mode, self._evaluate(j, A, i),
+                    B_mode, self._evaluate(j, B, i))
+        except _Unresolved as e:
+            pending[8] = e.args[0]
+            self._waiting[e.args[0]].append(pending)
+
+    def _define(self, name):
+        for pending in self._waiting.pop(name, ()):
+            self._resolve(pending)
+
+    def _assemble(self, lines, raw):
+        origin = ('0', -1)
+        queue = collections.deque()
         i = 0 # Line in the load file
         old_label = None
-        for (j, line) in enumerate(assembly.split('\n')):
-            label = None
+        for (j, line) in enumerate(lines):
+            line = line.rstrip('\r\n')
             if SYNTAX.comment_line.match(line):
+                comment = _header_comment(line)
+                if comment is not None:
+                    setattr(self, comment[0], comment[1])
                 continue
             tokens = [x for x in line.split(' ') if x != '']
             if tokens[0].split('.')[0] not in SYNTAX.opcodes:
@@ -105,8 +403,8 @@ class Assembler(object):
                 raise ParseError('On line %i: `%s` is not a valid opcode.' %
                         (j, splitted[0]))
             if len(splitted) > 2:
-                raise ParseError('On line %i: `%s` ' % (j, tokens[0]) +
-                        'is not a valid opcode.modifier syntax.')
+                raise ParseError('On line %i: `%s` ' % (j, '.'.join(splitted))
+                        + 'is not a valid opcode.modifier syntax.')
             opcode = splitted[0]
             if len(splitted) == 2:
                 if splitted[1] not in SYNTAX.modifiers:
@@ -117,44 +415,59 @@ class Assembler(object):
                 modifier = None
             if opcode == 'ORG':
                 old_label = None
-                origin = evaluate_operand(tokens.pop(0))
+                if tokens == []:
+                    raise ParseError('On line %i: `ORG` needs an operand.' %
+                            j)
+                origin = (tokens.pop(0), j)
             elif opcode == 'END':
                 old_label = None # Useless, but we do it anyway
-                origin = evaluate_operand(tokens.pop(0))
+                if tokens != [] and not tokens[0].startswith(';'):
+                    origin = (tokens.pop(0), j)
                 break
             elif opcode == 'EQU':
                 if label is None and old_label is None:
                     raise ParseError('On line %i: `EQU` used without any '%j +
                             'label.')
                 elif label is None:
-                    constants[old_label].append('\n' + ' '.join(tokens))
+                    self._constants[old_label] += '\n' + ' '.join(tokens)
+                    self._compiled_constants.pop(old_label, None)
                 else:
-                    constants[label] = ' '.join(tokens)
+                    self._constants[label] = ' '.join(tokens)
                     old_label = label
+                    self._define(label)
             else:
                 old_label = None
-                labels[label] = i
+                if label is not None:
+                    self._labels[label] = i
 
                 (A, B) = (None, None)
                 if len(tokens) > 0:
                     A = tokens.pop(0).strip(',')
                 if len(tokens) > 0:
                     B = tokens.pop(0)
-                load_queue.append((opcode, modifier, A, B))
+                # Line in the assembly, line in the load file, fields,
+                # missing name, and instruction once resolved.
+                pending = [j, i, opcode, modifier]
+                pending.extend(self._compile_operand(j, A))
+                pending.extend(self._compile_operand(j, B))
+                pending.extend([None, None])
+                queue.append(pending)
+                self._resolve(pending)
+                if label is not None:
+                    self._define(label)
                 i += 1
+            while queue and queue[0][9] is not None:
+                instruction = queue.popleft()[9]
+                yield str(instruction) + '\n' if raw else instruction
 
+        if queue:
+            raise ParseError('On line %i: `%s` is not defined.' %
+                    (queue[0][0], queue[0][8]))
+        (mode, function) = self._compile_operand(origin[1], origin[0])
+        try:
+            self.origin = self._evaluate(origin[1], function, 0)
+        except _Unresolved as e:
+            raise ParseError('On line %i: `%s` is not defined.' %
+                    (origin[1], e.args[0]))
         if raw:
-            load = 'ORG %i\n' % origin
-        else:
-            load = []
-        for (i, (opcode, modifier, A, B)) in enumerate(load_queue):
-                A = evaluate_operand(A)
-                B = evaluate_operand(B)
-                inst = core.Instruction(opcode=opcode, modifier=modifier,
-                        A=A, B=B)
-                if raw:
-                    load += str(inst) + '\n'
-                else:
-                    load.append(inst)
-        return (origin, load)
-
+            yield 'ORG %i\n' % self.origin
@@ -24,10 +24,19 @@
 
 from __future__ import print_function
 
-__all__ = ['RedcodeSyntaxError', 'Instruction', 'Mars', 'Memory', 'Warrior']
+__all__ = ['RedcodeSyntaxError', 'Instruction', 'Mars', 'Memory',
+        'ArrayMemory', 'Warrior', 'ThreadsView', 'BattleResult',
+        'RoundResult', 'Snapshot',
+        'Statistics', 'Placements', 'LOAD_FILE_MAGIC', 'dump_load_file']
 
 import re
+import time
+import mmap
+import random
+import struct
+import array
 import threading
+import contextlib
 import collections
 
 try:
@@ -44,10 +53,17 @@ except ImportError:
             return None
 
 STRICT = True # Strict type and value checks. A bit time-consuming (~10%)
+# Number of journal entries after which a Mars flushes its TraceRecorder
+JOURNAL_SIZE = 65536
 
 if 'xrange' not in globals(): # Python 3
     xrange = range
 
+# Addressing modes, stored as their index in SYNTAX.addressing.
+(IMMEDIATE, DIRECT, A_INDIRECT, B_INDIRECT,
+ A_PREDECREMENT, A_POSTINCREMENT, B_PREDECREMENT, B_POSTINCREMENT) = \
+         xrange(0, 8)
+
 @cfunc(operand=str)
 def get_int(operand):
     """Shortcut for extracting the integer from an operand."""
@@ -60,6 +76,27 @@ def get_int(operand):
     else:
         return int(operand)
 
+@cfunc(operand=str)
+def parse_operand(operand):
+    """Splits an operand string into its addressing mode and its value."""
+    if operand[0] in SYNTAX.addressing:
+        return (SYNTAX.addressing.index(operand[0]), int(operand[1:]))
+    else:
+        return (DIRECT, int(operand))
+
+@cfunc(mode=int, value=int)
+def format_operand(mode, value):
+    """Inverse of parse_operand."""
+    return '%s%i' % (SYNTAX.addressing[mode], value)
+
+@cfunc(value=int, size=int)
+def fold(value, size):
+    """Reduces the value modulo the core size, in ]-size/2, size/2]."""
+    value %= size
+    if value > size // 2:
+        value -= size
+    return value
+
 class SYNTAX:
     addressing = '#$*@{}<>'
 
@@ -71,6 +108,7 @@ class SYNTAX:
                       ) % ((field,)*2)
                      )
     data_blocks = ('opcode', 'modifier', 'A', 'B')
+    fields = ('opcode', 'modifier', 'A_mode', 'A_value', 'B_mode', 'B_value')
 
     opcodes = ('DAT MOV ADD SUB MUL DIV MOD JMP JMZ JMN DJN SPL CMP SEQ SNE '
             'SLT LDP STP NOP').split()
@@ -89,11 +127,27 @@ class SYNTAX:
             return False
         return True
 
+_opcode_ids = dict([(x, i) for (i, x) in enumerate(SYNTAX.opcodes)])
+# The last id stands for "no modifier given" (ie. the ICWS'94 default)
+_modifier_ids = dict([(x, i) for (i, x) in enumerate(SYNTAX.modifiers)])
+_modifier_ids[None] = len(SYNTAX.modifiers)
+_modifiers_by_id = SYNTAX.modifiers + [None]
+
 class RedcodeSyntaxError(Exception):
     pass
 
 class Instruction(object):
-    _data = cvar(list)
+    """A Redcode instruction. The opcode and the modifier are stored as
+    their index in SYNTAX.opcodes and SYNTAX.modifiers (None, the default
+    modifier, being the last one), the addressing modes as their index in
+    SYNTAX.addressing."""
+    __slots__ = ('_opcode', '_modifier', '_A_mode', '_A_value',
+            '_B_mode', '_B_value',
+            # Index of the handler in the dispatch table
+            '_id',
+            # Whether both operands are immediate or direct, ie. whether
+            # their pointers can be resolved without reading the memory
+            '_direct')
     def __init__(self, *data, **kwdata):
         if data != () and kwdata != {}:
             raise ValueError('You cannot give data both as non-keyword '
@@ -110,64 +164,99 @@ class Instruction(object):
         else:
             raise ValueError('When Instruction() is provided with '
                     'non-keyword arguments, they have to be 4.')
-        self._data = [data[0], data[1],
-                data[2] if data[2][0] in SYNTAX.addressing else '$' + data[2],
-                data[3] if data[3][0] in SYNTAX.addressing else '$' + data[3],
-            ]
+        self._opcode = _opcode_ids[data[0]]
+        self._modifier = _modifier_ids[data[1]]
+        (self._A_mode, self._A_value) = parse_operand(data[2])
+        (self._B_mode, self._B_value) = parse_operand(data[3])
+        self._decode()
+
+    @classmethod
+    def from_fields(cls, opcode, modifier, A_mode, A_value, B_mode, B_value):
+        """Builds an instruction from already decoded fields, without
+        any parsing."""
+        inst = cls.__new__(cls)
+        inst._opcode = _opcode_ids[opcode]
+        inst._modifier = _modifier_ids[modifier]
+        inst._A_mode = A_mode
+        inst._A_value = A_value
+        inst._B_mode = B_mode
+        inst._B_value = B_value
+        inst._decode()
+        return inst
+
+    def _decode(self):
+        """Resolves the handler of the instruction. Must be called each time
+        the opcode, the modifier or an addressing mode is changed."""
+        self._id = _decode_ids(self._opcode, self._modifier,
+                self._A_mode, self._B_mode)
+        self._direct = self._A_mode <= DIRECT and self._B_mode <= DIRECT
+
+    @property
+    def fields(self):
+        """Tuple of the decoded fields, named as in SYNTAX.fields."""
+        return (SYNTAX.opcodes[self._opcode],
+                _modifiers_by_id[self._modifier],
+                self._A_mode, self._A_value, self._B_mode, self._B_value)
+
+    def copy(self, size=None):
+        """Returns a copy of the instruction. If `size` is given, the values
+        of the copy are reduced modulo `size`."""
+        inst = Instruction.__new__(Instruction)
+        inst._opcode = self._opcode
+        inst._modifier = self._modifier
+        inst._A_mode = self._A_mode
+        inst._B_mode = self._B_mode
+        inst._id = self._id
+        inst._direct = self._direct
+        if size is None:
+            inst._A_value = self._A_value
+            inst._B_value = self._B_value
+        else:
+            inst._A_value = fold(self._A_value, size)
+            inst._B_value = fold(self._B_value, size)
+        return inst
 
     def __eq__(self, other):
         if isinstance(other, str):
             other = Instruction.from_string(other)
-        elif isinstance(other, tuple) and len(tuple) == 4:
+        elif isinstance(other, tuple) and len(other) == 4:
             other = Instruction.from_tuple(other)
         elif not isinstance(other, Instruction):
             return False
-        return all([getattr(self, x)==getattr(other, x)
-            for x in SYNTAX.data_blocks])
+        # The handler id stands for the opcode and the actual modifier
+        return self._id == other._id and \
+                self._A_value == other._A_value and \
+                self._B_value == other._B_value and \
+                self._A_mode == other._A_mode and \
+                self._B_mode == other._B_mode
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    def __hash__(self):
+        return hash((self._id, self._A_mode, self._A_value,
+                     self._B_mode, self._B_value))
     def __repr__(self):
         return '<%s.%s %r>' % (self.__class__.__module__,
                 self.__class__.__name__, str(self))
 
     def _get_opcode(self):
-        return self._data[0]
+        return SYNTAX.opcodes[self._opcode]
     def _set_opcode(self, value):
         if STRICT and value not in SYNTAX.opcodes:
             raise ValueError('%r is not a valid opcode.' % value)
-        self._data[0] = value
+        self._opcode = _opcode_ids[value]
+        self._decode()
     opcode = property(_get_opcode, _set_opcode)
     def _get_modifier(self):
-        if self._data[1] is not None:
-            return self._data[1]
-        elif self.opcode in ('DAT', 'NOP'):
-            return 'F'
-        elif self.opcode in ('MOV', 'SEQ', 'SNE', 'CMP'):
-            if self.A.startswith('#'):
-                return 'AB'
-            elif self.B.startswith('#'):
-                return 'B'
-            else:
-                return 'I'
-        elif self.opcode in ('ADD', 'SUB', 'MUL', 'DIV', 'MOD'):
-            if self.A.startswith('#'):
-                return 'AB'
-            elif self.B.startswith('#'):
-                return 'B'
-            else:
-                return 'F'
-        elif self.opcode in ('SLT', 'LDP', 'STP'):
-            if 'A'.startswith('#'):
-                return 'AB'
-            else:
-                return 'B'
-        elif self.opcode in ('JMP', 'JMZ', 'JMN', 'DJN', 'SPL'):
-            return 'B'
+        return _dispatch[self._id][1]
     def _set_modifier(self, value):
-        if STRICT and value not in SYNTAX.modifiers:
+        if STRICT and value is not None and value not in SYNTAX.modifiers:
             raise ValueError('%r is not a valid modifier' % value)
-        self._data[1] = value
+        self._modifier = _modifier_ids[value]
+        self._decode()
     modifier = property(_get_modifier, _set_modifier)
+
     def _get_A(self):
-        return self._data[2]
+        return format_operand(self.A_mode, self.A_value)
     def _set_A(self, value):
         if value is None:
             value = '$0'
@@ -175,20 +264,51 @@ class Instruction(object):
             value = '$' + value
         if STRICT and not SYNTAX.is_operand(value):
             raise ValueError('%r is not a valid operand' % value)
-        self._data[2] = value
+        (self.A_mode, self.A_value) = parse_operand(value)
     A = property(_get_A, _set_A)
     def _get_B(self):
-        return self._data[3]
+        return format_operand(self.B_mode, self.B_value)
     def _set_B(self, value):
         if value is None:
             value = '$0'
         if value[0] in '0123456789-':
             value = '$' + value
         if STRICT and not SYNTAX.is_operand(value):
-            raise ValueError('%r is not a valid operand')
-        self._data[3] = value
+            raise ValueError('%r is not a valid operand' % value)
+        (self.B_mode, self.B_value) = parse_operand(value)
     B = property(_get_B, _set_B)
 
+    def _get_A_mode(self):
+        return self._A_mode
+    def _set_A_mode(self, value):
+        if STRICT and value not in xrange(0, len(SYNTAX.addressing)):
+            raise ValueError('%r is not a valid addressing mode' % value)
+        self._A_mode = value
+        self._decode()
+    A_mode = property(_get_A_mode, _set_A_mode)
+    def _get_A_value(self):
+        return self._A_value
+    def _set_A_value(self, value):
+        if STRICT and not isinstance(value, int):
+            raise ValueError('%r is not an integer' % value)
+        self._A_value = value
+    A_value = property(_get_A_value, _set_A_value)
+    def _get_B_mode(self):
+        return self._B_mode
+    def _set_B_mode(self, value):
+        if STRICT and value not in xrange(0, len(SYNTAX.addressing)):
+            raise ValueError('%r is not a valid addressing mode' % value)
+        self._B_mode = value
+        self._decode()
+    B_mode = property(_get_B_mode, _set_B_mode)
+    def _get_B_value(self):
+        return self._B_value
+    def _set_B_value(self, value):
+        if STRICT and not isinstance(value, int):
+            raise ValueError('%r is not an integer' % value)
+        self._B_value = value
+    B_value = property(_get_B_value, _set_B_value)
+
     @classmethod
     def from_string(cls, string):
         assert isinstance(string, str)
@@ -223,220 +343,484 @@ class Instruction(object):
 
     @property
     def as_tuple(self):
-        return tuple(self._data)
+        return (self.opcode, _modifiers_by_id[self._modifier], self.A, self.B)
 
     @property
     def as_dict(self):
-        return dict(zip(SYNTAX.data_blocks, self._data))
-
+        return dict(zip(SYNTAX.data_blocks, self.as_tuple))
 
-    @cfunc(memory=object, ptr=int)
-    def _read(self, memory, ptr):
-        """Return input data of the instruction, based on modifiers.
 
-        Data with None should _never_ be read."""
-        m = cvar(str)
+    @cfunc(memory=object, ptr=int, strict=bool)
+    def run(self, memory, ptr, strict=True):
+        """Runs the instruction, which is at `ptr`, and returns the list
+        of the new processes. If `strict` is false, STRICT checks are
+        skipped."""
+        A_ptr = cvar(int)
+        B_ptr = cvar(int)
         A = cvar(object)
-        B = cvar(object)
-
-        m = self.modifier
-        A = memory.read(memory.get_absolute_ptr(ptr, self.A))
-        B = memory.read(memory.get_absolute_ptr(ptr, self.B))
-        if m == 'A':
-            return ((None, None, A.A, None), (None, None, B.A, None))
-        elif m == 'B':
-            return ((None, None, A.B, None), (None, None, B.B, None))
-        elif m == 'AB':
-            return ((None, None, A.A, None), (None, None, B.B, None))
-        elif m == 'BA':
-            return ((None, None, A.B, None), (None, None, B.A, None))
-        elif m == 'F':
-            return ((None, None, A.A, A.B ), (None, None, B.A, B.B ))
-        elif m == 'X':
-            return ((None, None, A.A, A.B ), (None, None, B.B, B.A ))
-        elif m == 'I':
-            return (A.as_tuple, B.as_tuple)
+
+        assert not (strict and STRICT) or memory.read(ptr) == self
+
+        if self._direct:
+            # Nothing to increment, and nothing to read: the pointers only
+            # depend on the values.
+            A_ptr = ptr + self._A_value if self._A_mode == DIRECT else ptr
+            B_ptr = ptr + self._B_value if self._B_mode == DIRECT else ptr
+            return _dispatch[self._id][2](self, memory, ptr,
+                    A_ptr, B_ptr, None, None)
+
+        # Operands are evaluated in order, as in ICWS'94 (section 5.3): the
+        # fields of the instruction are read before the A operand can
+        # change them, and each register (IRA, IRB) is read before the
+        # postincrement of its operand. A register is only copied if a
+        # later increment changes its cell; otherwise the handler reads
+        # it from the memory.
+        (handler, reads_A, reads_B) = _dispatch[self._id][2:5]
+        (A_mode, A_value, B_mode, B_value) = (self._A_mode, self._A_value,
+                self._B_mode, self._B_value)
+        size = memory.size
+        A_ptr = _evaluate(memory, ptr, A_mode, A_value)
+        if reads_A and ((A_mode == A_POSTINCREMENT or
+                A_mode == B_POSTINCREMENT) and
+                (ptr + A_value - A_ptr) % size == 0 or
+                B_mode >= A_PREDECREMENT and
+                (ptr + B_value - A_ptr) % size == 0):
+            A = memory.read(A_ptr).copy()
         else:
-            assert False
-
-    @cfunc(memory=object, dest=int, inst=object)
-    def _write(self, memory, dest, inst):
-        """Writes data to the memory"""
-        m = cvar(str)
-
-        m = self.modifier
-        if isinstance(inst, tuple):
-            if m != 'I':
-                # Add an opcode if needed, so it passes sanity checks
-                inst = (inst[0] or 'DAT', inst[1], inst[2], inst[3])
-            inst = Instruction.from_tuple(inst)
-        elif STRICT and not isinstance(inst, Instruction):
-            raise ValueError('You can only write tuples and instructions, '
-                    'not %r' % inst)
-        if STRICT and not isinstance(dest, int):
-            raise ValueError('Destination must be an int, not %r.' % dest)
-
-        if m == 'A':
-            memory.write(dest, A=inst.A)
-        elif m == 'B':
-            memory.write(dest, B=inst.A)
-        elif m == 'AB':
-            memory.write(dest, B=inst.A)
-        elif m == 'BA':
-            memory.write(dest, A=inst.A)
-        elif m == 'F':
-            memory.write(dest, A=inst.A, B=inst.B)
-        elif m == 'X':
-            memory.write(dest, B=inst.B, A=inst.A)
-        elif m == 'I':
-            memory.write(dest, instruction=inst)
+            A = None
+        _increment(memory, ptr, A_mode, A_value)
+        B_ptr = _evaluate(memory, ptr, B_mode, B_value)
+        if reads_B and (B_mode == A_POSTINCREMENT or
+                B_mode == B_POSTINCREMENT) and \
+                (ptr + B_value - B_ptr) % size == 0:
+            B = memory.read(B_ptr).copy()
         else:
-            assert False
-
-    @cfunc(A=tuple, B=tuple, function=object)
-    def _math(self, A, B, function):
-        "Shortcut for running math operations."
-        res1 = cvar(str)
-        res2 = cvar(str)
-
-        assert None not in (A[2], B[2])
-        res1 = B[2][0]+str(function(get_int(A[2]), get_int(B[2])))
-        res2 = None
-        if A[3] is not None:
-            assert B[3] is not None
-            res2 = B[3][0]+str(function(get_int(A[3]), get_int(B[3])))
-        return (B[0], B[1], res1, res2)
-    @cfunc(memory=object, ptr=int, field=str)
-    def _increment(self, memory, ptr, field):
-        "Shortcut for incrementing fields."
-        inst = cvar(object)
-
-        inst = memory.read(ptr + get_int(field))
-        if field.startswith('}'):
-            inst.A = inst.A[0] + str(int(inst.A[1:])+1)
-        elif field.startswith('>'):
-            inst.B = inst.B[0] + str(int(inst.B[1:])+1)
-    @cfunc(memory=object, ptr=int)
-    def run(self, memory, ptr):
-        oc = cvar(str)
-        dest = cvar(int)
-        A = cvar(object)
-        B = cvar(object)
-        threads = cvar(list)
-
-        assert memory.read(ptr) == self
-
-        # Predecrement
-        for field in (self.A, self.B):
-            inst = memory.read(ptr + get_int(field))
-            if field.startswith('{'):
-                inst.A = inst.A[0] + str(int(inst.A[1:])-1)
-            elif field.startswith('<'):
-                inst.B = inst.B[0] + str(int(inst.B[1:])-1)
-
-        oc = self.opcode
-
-        # Postincrement
-        # The order matters: http://www.koth.org/info/icws94.html#5.3.5
-        self._increment(memory, ptr, self.A)
-        dest = memory.get_absolute_ptr(ptr, self.B)
-        self._increment(memory, ptr, self.B)
-        A, B = self._read(memory, ptr)
-
-        if oc == 'DAT':
-            threads = []
-        elif oc == 'NOP':
-            threads = [ptr+1]
-        elif oc == 'MOV':
-            self._write(memory, dest, A)
-            threads = [ptr+1]
-        elif oc == 'ADD':
-            self._write(memory, dest, self._math(A, B, lambda a,b:a+b))
-            threads = [ptr+1]
-        elif oc == 'SUB':
-            self._write(memory, dest, self._math(A, B, lambda a,b:b-a))
-            threads = [ptr+1]
-        elif oc == 'MUL':
-            self._write(memory, dest, self._math(A, B, lambda a,b:a*b))
-            threads = [ptr+1]
-        elif oc == 'DIV':
-            try:
-                self._write(memory, dest, self._math(A, B, lambda a,b:int(b/a)))
-                threads = [ptr+1]
-            except ZeroDivisionError:
-                threads = []
-        elif oc == 'MOD':
+            B = None
+        _increment(memory, ptr, B_mode, B_value)
+        return handler(self, memory, ptr, A_ptr, B_ptr, A, B)
+
+@cfunc(memory=object, ptr=int, mode=int, value=int)
+def _evaluate(memory, ptr, mode, value):
+    """Returns the pointer an operand of the instruction at `ptr` resolves
+    to, after applying its predecrement. The postincrement is applied by
+    `_increment`, once the register is read."""
+    if mode == IMMEDIATE:
+        return ptr
+    ptr += value
+    if mode == DIRECT:
+        return ptr
+    if mode == A_PREDECREMENT:
+        memory.set_a(ptr, memory.read(ptr)._A_value - 1)
+    elif mode == B_PREDECREMENT:
+        memory.set_b(ptr, memory.read(ptr)._B_value - 1)
+    if mode == A_INDIRECT or mode == A_PREDECREMENT or \
+            mode == A_POSTINCREMENT:
+        return ptr + memory.read(ptr)._A_value
+    else:
+        return ptr + memory.read(ptr)._B_value
+
+@cfunc(memory=object, ptr=int, mode=int, value=int)
+def _increment(memory, ptr, mode, value):
+    """Applies the postincrement of an operand of the instruction at
+    `ptr`, if any."""
+    if mode == A_POSTINCREMENT:
+        ptr += value
+        memory.set_a(ptr, memory.read(ptr)._A_value + 1)
+    elif mode == B_POSTINCREMENT:
+        ptr += value
+        memory.set_b(ptr, memory.read(ptr)._B_value + 1)
+
+# Each handler implements an (opcode, modifier) pair. They are called with
+# the running instruction, the memory, the pointer to the instruction, the
+# pointers given by the A and B operands, and the A and B registers (IRA
+# and IRB) if they had to be copied before an increment changed them (None
+# if they can be read at A_ptr and B_ptr). They return the list of new
+# threads.
+
+# Pairs of (field of the A instruction, field of the B instruction) each
+# modifier works on.
+_modifier_fields = {
+        'A': (('_A_value', '_A_value'),),
+        'B': (('_B_value', '_B_value'),),
+        'AB': (('_A_value', '_B_value'),),
+        'BA': (('_B_value', '_A_value'),),
+        'F': (('_A_value', '_A_value'), ('_B_value', '_B_value')),
+        'X': (('_A_value', '_B_value'), ('_B_value', '_A_value')),
+        'I': (('_A_value', '_A_value'), ('_B_value', '_B_value')),
+        }
+# Name of the Memory method setting each field in place
+_setters = {'_A_value': 'set_a', '_B_value': 'set_b'}
+
+def _dat(inst, memory, ptr, A_ptr, B_ptr, A, B):
+    return []
+
+def _nop(inst, memory, ptr, A_ptr, B_ptr, A, B):
+    return [(ptr+1) % memory.size]
+
+def _jmp(inst, memory, ptr, A_ptr, B_ptr, A, B):
+    # Note that the modifier is ignored
+    return [A_ptr % memory.size]
+
+def _spl(inst, memory, ptr, A_ptr, B_ptr, A, B):
+    return [(ptr+1) % memory.size, A_ptr % memory.size]
+
+def _not_implemented(inst, memory, ptr, A_ptr, B_ptr, A, B):
+    raise NotImplementedError()
+
+def _make_mov(modifier):
+    fields = [(a, _setters[b]) for (a, b) in _modifier_fields[modifier]]
+    if modifier == 'I':
+        def mov(inst, memory, ptr, A_ptr, B_ptr, A, B):
+            if A is None:
+                memory.copy_cell(A_ptr, B_ptr)
+            else:
+                memory.write(B_ptr, A)
+            return [(ptr+1) % memory.size]
+    elif len(fields) == 1:
+        [(a, b)] = fields
+        def mov(inst, memory, ptr, A_ptr, B_ptr, A, B):
+            if A is None:
+                A = memory.read(A_ptr)
+            getattr(memory, b)(B_ptr, getattr(A, a))
+            return [(ptr+1) % memory.size]
+    else:
+        [(a1, b1), (a2, b2)] = fields
+        def mov(inst, memory, ptr, A_ptr, B_ptr, A, B):
+            if A is None:
+                A = memory.read(A_ptr)
+            # Both values are read first, A and B may be the same cell.
+            (value1, value2) = (getattr(A, a1), getattr(A, a2))
+            getattr(memory, b1)(B_ptr, value1)
+            getattr(memory, b2)(B_ptr, value2)
+            return [(ptr+1) % memory.size]
+    return mov
+
+def _make_math(function, modifier):
+    fields = [(a, b, _setters[b]) for (a, b) in _modifier_fields[modifier]]
+    def math(inst, memory, ptr, A_ptr, B_ptr, A, B):
+        size = memory.size
+        if A is None:
+            A = memory.read(A_ptr)
+        if B is None:
+            B = memory.read(B_ptr)
+        results = []
+        alive = True
+        for (a, b, setter) in fields:
             try:
-                self._write(memory, dest, self._math(A, B, lambda a,b:b%a))
-                threads = [ptr+1]
+                results.append((setter, function(getattr(A, a) % size,
+                                                 getattr(B, b) % size)))
             except ZeroDivisionError:
-                threads = []
-        elif oc == 'JMP':
-            # Note that the modifier is ignored
-            threads = [memory.get_absolute_ptr(ptr, self.A)]
-        elif oc == 'JMZ':
-            if get_int(B[2]) == 0 and \
-                    (B[3] is None or get_int(B[3]) == 0):
-                threads = [memory.get_absolute_ptr(ptr, self.A)]
-            else:
-                threads = [ptr+1]
-        elif oc == 'JMN':
-            if get_int(B[2]) == 0 and \
-                    (B[3] is None or get_int(B[3]) == 0):
-                threads = [ptr+1]
-            else:
-                threads = [memory.get_absolute_ptr(ptr, self.A)]
-        elif oc == 'DJN':
-            self.B = self.B[0] + str(get_int(self.B)-1)
-            ptrB = memory.get_absolute_ptr(ptr, self.B)
-            B = self._read(memory, ptrB)[1] # Load the new pointed data
-
-            # Jump
-            if get_int(B[2]) == 0 and \
-                    (B[3] is None or get_int(B[3]) == 0):
-                threads = [ptr+1]
-            else:
-                threads = [memory.get_absolute_ptr(ptr, self.A)]
-        elif oc == 'CMP' or oc == 'SEQ':
-            if A == B:
-                threads = [ptr+2]
+                alive = False
+        for (setter, value) in results:
+            getattr(memory, setter)(B_ptr, value)
+        return [(ptr+1) % size] if alive else []
+    return math
+
+def _make_jmz(modifier):
+    fields = [b for (a, b) in _modifier_fields[modifier]]
+    def jmz(inst, memory, ptr, A_ptr, B_ptr, A, B):
+        if B is None:
+            B = memory.read(B_ptr)
+        if any([getattr(B, b) for b in fields]):
+            return [(ptr+1) % memory.size]
+        else:
+            return [A_ptr % memory.size]
+    return jmz
+
+def _make_jmn(modifier):
+    fields = [b for (a, b) in _modifier_fields[modifier]]
+    def jmn(inst, memory, ptr, A_ptr, B_ptr, A, B):
+        if B is None:
+            B = memory.read(B_ptr)
+        if any([getattr(B, b) for b in fields]):
+            return [A_ptr % memory.size]
+        else:
+            return [(ptr+1) % memory.size]
+    return jmn
+
+def _make_djn(modifier):
+    fields = [(b, _setters[b]) for (a, b) in _modifier_fields[modifier]]
+    def djn(inst, memory, ptr, A_ptr, B_ptr, A, B):
+        size = memory.size
+        cell = memory.read(B_ptr)
+        if B is None:
+            B = cell
+        # The jump depends on the decremented B register
+        jump = any([(getattr(B, b) - 1) % size for (b, setter) in fields])
+
+        # Decrement the pointed fields
+        for (b, setter) in fields:
+            getattr(memory, setter)(B_ptr, getattr(cell, b) - 1)
+
+        if jump:
+            return [A_ptr % size]
+        else:
+            return [(ptr+1) % size]
+    return djn
+
+def _make_cmp(modifier, skip_if_equal=True):
+    """Returns the handler of CMP and SEQ, or of SNE if `skip_if_equal` is
+    false. Fields are compared one by one, without building tuples."""
+    fields = _modifier_fields[modifier]
+    if modifier == 'I':
+        def equal(A, B):
+            # The handler id stands for the opcode and the actual modifier
+            return A._id == B._id and \
+                    A._A_value == B._A_value and \
+                    A._B_value == B._B_value and \
+                    A._A_mode == B._A_mode and \
+                    A._B_mode == B._B_mode
+    elif len(fields) == 1:
+        [(a, b)] = fields
+        def equal(A, B):
+            return getattr(A, a) == getattr(B, b)
+    else:
+        [(a1, b1), (a2, b2)] = fields
+        def equal(A, B):
+            return getattr(A, a1) == getattr(B, b1) and \
+                    getattr(A, a2) == getattr(B, b2)
+    def cmp(inst, memory, ptr, A_ptr, B_ptr, A, B):
+        if A is None:
+            A = memory.read(A_ptr)
+        if B is None:
+            B = memory.read(B_ptr)
+        if equal(A, B) == skip_if_equal:
+            return [(ptr+2) % memory.size]
+        else:
+            return [(ptr+1) % memory.size]
+    return cmp
+
+def _make_slt(modifier):
+    fields = _modifier_fields[modifier]
+    if len(fields) == 1:
+        [(a, b)] = fields
+        def slt(inst, memory, ptr, A_ptr, B_ptr, A, B):
+            size = memory.size
+            if A is None:
+                A = memory.read(A_ptr)
+            if B is None:
+                B = memory.read(B_ptr)
+            if getattr(A, a) % size < getattr(B, b) % size:
+                return [(ptr+2) % size]
             else:
-                threads = [ptr+1]
-        elif oc == 'SLT':
-            if get_int(A[2]) < get_int(B[2]) and \
-                    (A[3] is None or A[3] < B[3]):
-                threads = [ptr+2]
+                return [(ptr+1) % size]
+    else:
+        [(a1, b1), (a2, b2)] = fields
+        def slt(inst, memory, ptr, A_ptr, B_ptr, A, B):
+            size = memory.size
+            if A is None:
+                A = memory.read(A_ptr)
+            if B is None:
+                B = memory.read(B_ptr)
+            if getattr(A, a1) % size < getattr(B, b1) % size and \
+                    getattr(A, a2) % size < getattr(B, b2) % size:
+                return [(ptr+2) % size]
             else:
-                threads = [ptr+1]
-        elif oc == 'SPL':
-            threads = [ptr+1, ptr+get_int(self.A)]
+                return [(ptr+1) % size]
+    return slt
+
+# Pair of (field of the A instruction, field of the B instruction) LDP and
+# STP work on: the index and the destination for LDP, the value and the
+# index for STP. F, X and I behave as B.
+_pspace_fields = dict([(x, _modifier_fields[x][0])
+                       for x in ('A', 'B', 'AB', 'BA')] +
+                      [(x, _modifier_fields['B'][0]) for x in ('F', 'X', 'I')])
+
+def _get_pspace(memory):
+    if memory._pspace is None:
+        raise ValueError('No P-space: the instruction must be run by a '
+                'warrior loaded in a Mars.')
+    return memory._pspace
+
+def _make_ldp(modifier):
+    (a, b) = _pspace_fields[modifier]
+    setter = _setters[b]
+    def ldp(inst, memory, ptr, A_ptr, B_ptr, A, B):
+        pspace = _get_pspace(memory)
+        if A is None:
+            A = memory.read(A_ptr)
+        index = getattr(A, a) % len(pspace)
+        getattr(memory, setter)(B_ptr, pspace[index])
+        return [(ptr+1) % memory.size]
+    return ldp
+
+def _make_stp(modifier):
+    (a, b) = _pspace_fields[modifier]
+    def stp(inst, memory, ptr, A_ptr, B_ptr, A, B):
+        pspace = _get_pspace(memory)
+        if B is None:
+            B = memory.read(B_ptr)
+        index = getattr(B, b) % len(pspace)
+        if A is None:
+            A = memory.read(A_ptr)
+        pspace[index] = getattr(A, a) % memory.size
+        return [(ptr+1) % memory.size]
+    return stp
+
+_math_functions = {
+        'ADD': lambda a,b:b+a,
+        'SUB': lambda a,b:b-a,
+        'MUL': lambda a,b:b*a,
+        'DIV': lambda a,b:b//a,
+        'MOD': lambda a,b:b%a,
+        }
+
+@cfunc(opcode=str, modifier=str)
+def _make_handler(opcode, modifier):
+    if opcode == 'DAT':
+        return _dat
+    elif opcode == 'NOP':
+        return _nop
+    elif opcode == 'MOV':
+        return _make_mov(modifier)
+    elif opcode in _math_functions:
+        return _make_math(_math_functions[opcode], modifier)
+    elif opcode == 'JMP':
+        return _jmp
+    elif opcode == 'JMZ':
+        return _make_jmz(modifier)
+    elif opcode == 'JMN':
+        return _make_jmn(modifier)
+    elif opcode == 'DJN':
+        return _make_djn(modifier)
+    elif opcode == 'CMP' or opcode == 'SEQ':
+        return _make_cmp(modifier)
+    elif opcode == 'SNE':
+        return _make_cmp(modifier, skip_if_equal=False)
+    elif opcode == 'SLT':
+        return _make_slt(modifier)
+    elif opcode == 'LDP':
+        return _make_ldp(modifier)
+    elif opcode == 'STP':
+        return _make_stp(modifier)
+    elif opcode == 'SPL':
+        return _spl
+    else:
+        return _not_implemented
+
+# Opcodes whose handlers read the A and the B registers; the others need
+# no copy of them.
+_reads_A = frozenset(['MOV', 'ADD', 'SUB', 'MUL', 'DIV', 'MOD', 'CMP', 'SEQ',
+                      'SNE', 'SLT', 'LDP', 'STP'])
+_reads_B = frozenset(['ADD', 'SUB', 'MUL', 'DIV', 'MOD', 'JMZ', 'JMN', 'DJN',
+                      'CMP', 'SEQ', 'SNE', 'SLT', 'STP'])
+
+# List of (opcode, modifier, handler, reads_A, reads_B), indexed by the
+# instructions' _id
+_dispatch = []
+_dispatch_ids = {}
+for opcode in SYNTAX.opcodes:
+    for modifier in SYNTAX.modifiers:
+        _dispatch_ids[(opcode, modifier)] = len(_dispatch)
+        _dispatch.append((opcode, modifier, _make_handler(opcode, modifier),
+                          opcode in _reads_A, opcode in _reads_B))
+
+@cfunc(opcode=str, A_mode=int, B_mode=int)
+def default_modifier(opcode, A_mode, B_mode):
+    """Returns the modifier ICWS'94 uses when none is given."""
+    if opcode in ('DAT', 'NOP'):
+        return 'F'
+    elif opcode in ('MOV', 'SEQ', 'SNE', 'CMP'):
+        if A_mode == IMMEDIATE:
+            return 'AB'
+        elif B_mode == IMMEDIATE:
+            return 'B'
+        else:
+            return 'I'
+    elif opcode in ('ADD', 'SUB', 'MUL', 'DIV', 'MOD'):
+        if A_mode == IMMEDIATE:
+            return 'AB'
+        elif B_mode == IMMEDIATE:
+            return 'B'
         else:
-            raise NotImplementedError()
+            return 'F'
+    elif opcode in ('SLT', 'LDP', 'STP'):
+        if A_mode == IMMEDIATE:
+            return 'AB'
+        else:
+            return 'B'
+    elif opcode in ('JMP', 'JMZ', 'JMN', 'DJN', 'SPL'):
+        return 'B'
 
-        return threads
+@cfunc(opcode=str, modifier=object, A_mode=int, B_mode=int)
+def decode(opcode, modifier, A_mode, B_mode):
+    """Returns the index of the handler of an instruction in the dispatch
+    table."""
+    if modifier is None:
+        modifier = default_modifier(opcode, A_mode, B_mode)
+    return _dispatch_ids[(opcode, modifier)]
+
+@cfunc(opcode=int, modifier=int, A_mode=int, B_mode=int)
+def _decode_ids(opcode, modifier, A_mode, B_mode):
+    """Same as decode, with the index of the opcode and of the modifier."""
+    return decode(SYNTAX.opcodes[opcode], _modifiers_by_id[modifier],
+            A_mode, B_mode)
 
 class Memory(object):
     _memory = cvar(list)
     _size = cvar(int)
     _loaded_warriors = cvar(dict)
     _lock = cvar(object)
+    # Warrior whose instruction is running, set by the Mars; it is the
+    # owner of the changes given to batch callbacks.
+    _owner = None
+    # P-space of the warrior whose instruction is running, set by
+    # Warrior.run for LDP and STP.
+    _pspace = None
+    # List of integers the changes are appended to, while a trace is
+    # recorded (see tracing.TraceRecorder). A write appends `ptr` and the
+    # new A value, `ptr+size` and the new B value, `dest+2*size` and the
+    # pointer it copies, or `ptr+3*size` and the fields of the cell (as in
+    # binary load files). Warrior.run appends the end of each step: -2
+    # minus the number of processes created, followed by them. The Mars
+    # appends -1 at the end of each cycle.
+    _journal = None
     def __init__(self, size):
         if not isinstance(size, int):
             raise ValueError('Memory size must be an integer, not %r' % size)
         self._size = size
-        self._memory = collections.deque([Instruction('DAT', None, '$0', '$0')
-                for x in xrange(0, self.size)], self.size)
+        self._memory = collections.deque([Instruction.from_fields('DAT', None,
+                DIRECT, 0, DIRECT, 0) for x in xrange(0, self.size)],
+                self.size)
         self._loaded_warriors = {}
         self._callbacks = []
+        self._batch_callbacks = []
+        self._changes = {}
         self._lock = threading.RLock()
 
     @cfunc(callback=object)
-    def add_callback(self, callback):
-        if callback not in self._callbacks:
-            self._callbacks.append(callback)
+    def add_callback(self, callback, batch=False):
+        """Registers a callback called with `(ptr, old, new)` after each
+        write, or, if `batch` is True, called with the list of the
+        `(ptr, old_opcode, new_opcode, owner)` changes when they are
+        flushed (at the end of each Mars cycle). Changes of a cell are
+        coalesced between two flushes."""
+        callbacks = self._batch_callbacks if batch else self._callbacks
+        if callback not in callbacks:
+            callbacks.append(callback)
     @cfunc(callback=object)
     def remove_callback(self, callback):
-        self._callbacks.remove(callback)
+        if callback in self._batch_callbacks:
+            self._batch_callbacks.remove(callback)
+        else:
+            self._callbacks.remove(callback)
+
+    def _record(self, ptr, old_opcode, new_opcode):
+        change = self._changes.get(ptr)
+        if change is not None:
+            old_opcode = change[0]
+        self._changes[ptr] = (old_opcode, new_opcode, self._owner)
+
+    def flush_changes(self):
+        """Gives the changes recorded since the last flush to the batch
+        callbacks."""
+        with self._lock:
+            if not self._changes:
+                return
+            (changes, self._changes) = (self._changes, {})
+        changes = [(ptr,) + changes[ptr] for ptr in sorted(changes)]
+        for callback in self._batch_callbacks:
+            callback(changes)
 
     @property
     def size(self):
@@ -457,7 +841,6 @@ class Memory(object):
             return self._memory[ptr]
     @cfunc(ptr=int)
     def write(self, ptr, instruction=None, **kwargs):
-        data = cvar(dict)
         old_instruction = cvar(object)
         if STRICT and not isinstance(ptr, int):
             raise ValueError('Pointer must be an integer, not %r' % ptr)
@@ -469,42 +852,196 @@ class Memory(object):
             if STRICT and kwargs != {}:
                 raise ValueError('Cannot supply extra attribute if '
                         'instruction is given')
+            # Cells are changed in place, so they must not be shared with
+            # the caller.
+            instruction = instruction.copy()
             with self._lock:
                 old_instruction = self._memory[ptr]
                 self._memory[ptr] = instruction
+                if self._journal is not None:
+                    self._journal_cell(ptr)
+                if self._batch_callbacks:
+                    self._record(ptr, old_instruction.opcode,
+                            instruction.opcode)
             for callback in self._callbacks:
                 callback(ptr, old_instruction, instruction)
         else:
             for key in kwargs:
-                if key not in SYNTAX.data_blocks:
-                    raise ValueError('%r is not a valid data block.')
-            data = self.read(ptr).as_dict
-            data.update(kwargs)
-            self.write(ptr, Instruction(**data))
-
-    @cfunc(base_ptr=int, value=str)
-    def get_absolute_ptr(self, base_ptr, value):
-        if STRICT and len(value) < 2:
-            raise ValueError('The operand can be only A or B')
+                if key not in SYNTAX.data_blocks and \
+                        key not in SYNTAX.fields:
+                    raise ValueError('%r is not a valid data block.' % key)
+            self._change(ptr, self._unlocked_write, ptr, None, kwargs)
+
+    @cfunc(ptr=int, value=int)
+    def set_a(self, ptr, value):
+        """Sets the A value of a cell in place. The value is reduced
+        modulo the size."""
+        self._change(ptr, self._unlocked_set_a, ptr, value)
+    @cfunc(ptr=int, value=int)
+    def set_b(self, ptr, value):
+        """Sets the B value of a cell in place. The value is reduced
+        modulo the size."""
+        self._change(ptr, self._unlocked_set_b, ptr, value)
+    @cfunc(source=int, dest=int)
+    def copy_cell(self, source, dest):
+        """Copies the content of a cell into another one, in place."""
+        self._change(dest, self._unlocked_copy_cell, source, dest)
+
+    @cfunc(ptr=int)
+    def _change(self, ptr, function, arg1, arg2, kwargs=None):
+        """Calls `function`, which changes the cell `ptr` in place, and
+        notifies the callbacks."""
+        old_instruction = cvar(object)
+        if STRICT and not isinstance(ptr, int):
+            raise ValueError('Pointer must be an integer, not %r' % ptr)
+        ptr %= self.size
+        with self._lock:
+            cell = self._unlocked_read(ptr)
+            if self._callbacks:
+                old_instruction = cell.copy()
+            if self._batch_callbacks:
+                old_opcode = cell.opcode
+            if kwargs:
+                function(arg1, arg2, **kwargs)
+            else:
+                function(arg1, arg2)
+            if self._journal is not None:
+                self._journal_cell(ptr)
+            if self._batch_callbacks:
+                self._record(ptr, old_opcode, cell.opcode)
+        for callback in self._callbacks:
+            callback(ptr, old_instruction, cell)
+
+    @cfunc(ptr=int)
+    def _unlocked_read(self, ptr):
+        return self._memory[ptr % self._size]
+    @cfunc(ptr=int)
+    def _unlocked_write(self, ptr, instruction=None, **kwargs):
+        ptr %= self._size
+        if instruction is None:
+            instruction = self._memory[ptr]
+            for (key, value) in kwargs.items():
+                setattr(instruction, key, value)
+        else:
+            self._memory[ptr] = instruction.copy()
+    @cfunc(ptr=int, value=int)
+    def _unlocked_set_a(self, ptr, value):
+        self._memory[ptr % self._size]._A_value = fold(value, self._size)
+    @cfunc(ptr=int, value=int)
+    def _unlocked_set_b(self, ptr, value):
+        self._memory[ptr % self._size]._B_value = fold(value, self._size)
+    @cfunc(source=int, dest=int)
+    def _unlocked_copy_cell(self, source, dest):
+        (memory, size) = (self._memory, self._size)
+        (source, cell) = (memory[source % size], memory[dest % size])
+        cell._opcode = source._opcode
+        cell._modifier = source._modifier
+        cell._A_mode = source._A_mode
+        cell._A_value = source._A_value
+        cell._B_mode = source._B_mode
+        cell._B_value = source._B_value
+        cell._id = source._id
+        cell._direct = source._direct
+
+    def clear(self):
+        """Fills the memory with DAT.F $0, $0. Callbacks are called for
+        the cells which changed."""
+        blank = Instruction.from_fields('DAT', None, DIRECT, 0, DIRECT, 0)
+        with self._lock:
+            if self._callbacks or self._batch_callbacks:
+                for ptr in xrange(0, self._size):
+                    if self._memory[ptr] != blank:
+                        self.write(ptr, blank)
+            else:
+                self._memory.clear()
+                self._memory.extend([blank.copy()
+                                     for x in xrange(0, self._size)])
+        self.flush_changes()
+
+    @contextlib.contextmanager
+    def fast_path(self):
+        """Context in which reads and writes skip locking, sanity checks
+        and callbacks. It must not be used while other threads access the
+        memory.
+
+        If callbacks are registered, it falls back to the regular methods,
+        so the callbacks are still called. Nested contexts keep the
+        methods of the outermost one."""
+        if self._callbacks or self._batch_callbacks or 'read' in vars(self):
+            yield
+            return
+        self.read = self._unlocked_read
+        if self._journal is None:
+            self.write = self._unlocked_write
+            self.set_a = self._unlocked_set_a
+            self.set_b = self._unlocked_set_b
+            self.copy_cell = self._unlocked_copy_cell
+        else:
+            self.write = self._journaled_write
+            self.set_a = self._journaled_set_a
+            self.set_b = self._journaled_set_b
+            self.copy_cell = self._journaled_copy_cell
+        try:
+            yield
+        finally:
+            del self.read
+            del self.write
+            del self.set_a
+            del self.set_b
+            del self.copy_cell
+
+    # Unlocked writes which also append their record to the journal, see
+    # the _journal attribute.
+    @cfunc(ptr=int)
+    def _journal_cell(self, ptr):
+        ptr %= self._size
+        inst = self._unlocked_read(ptr)
+        self._journal.extend((ptr + 3*self._size, inst._opcode,
+                inst._modifier, inst._A_mode, inst._B_mode, inst._A_value,
+                inst._B_value))
+    @cfunc(ptr=int)
+    def _journaled_write(self, ptr, instruction=None, **kwargs):
+        self._unlocked_write(ptr, instruction, **kwargs)
+        self._journal_cell(ptr)
+    @cfunc(ptr=int, value=int)
+    def _journaled_set_a(self, ptr, value):
+        ptr %= self._size
+        value = fold(value, self._size)
+        self._memory[ptr]._A_value = value
+        self._journal.extend((ptr, value))
+    @cfunc(ptr=int, value=int)
+    def _journaled_set_b(self, ptr, value):
+        ptr %= self._size
+        value = fold(value, self._size)
+        self._memory[ptr]._B_value = value
+        self._journal.extend((ptr + self._size, value))
+    @cfunc(source=int, dest=int)
+    def _journaled_copy_cell(self, source, dest):
+        self._unlocked_copy_cell(source, dest)
+        self._journal.extend((dest % self._size + 2*self._size,
+                              source % self._size))
+
+    @cfunc(base_ptr=int, mode=int, value=int)
+    def get_absolute_ptr(self, base_ptr, mode, value):
+        """Returns the pointer an operand of the instruction at `base_ptr`
+        resolves to, without applying its predecrement or
+        postincrement."""
         if STRICT and not isinstance(base_ptr, int):
             raise ValueError('Pointer must be an integer, not %r.' % base_ptr)
-        ptr = base_ptr + get_int(value)
-        char = value[0]
-        if char not in '#$':
-            value2 = self.read(ptr)
-
-        if char == '#':
+        if mode == IMMEDIATE:
             return base_ptr
-        elif char == '$':
+        ptr = base_ptr + value
+        if mode == DIRECT:
             return ptr
-        elif char == '*':
-            return ptr + get_int(value2.A)
-        elif char == '@':
-            return ptr + get_int(value2.B)
-        elif char in '{}':
-            return base_ptr + get_int(value2.A)
-        elif char in '<>':
-            return base_ptr + get_int(value2.B)
+        inst = self.read(ptr)
+        if mode == A_INDIRECT:
+            return ptr + inst.A_value
+        elif mode == B_INDIRECT:
+            return ptr + inst.B_value
+        elif mode == A_PREDECREMENT or mode == A_POSTINCREMENT:
+            return ptr + inst.A_value
+        else:
+            return ptr + inst.B_value
 
     @cfunc(ptr=int, warrior=object)
     def load(self, ptr, warrior):
@@ -514,9 +1051,230 @@ class Memory(object):
         if STRICT and not isinstance(ptr, int):
             raise ValueError('Pointer must be an integer, not %r.' % ptr)
 
+        if warrior._packed is not None and warrior._initial_program is None:
+            # Binary load file, not decoded yet
+            warrior._start(ptr)
+            self._load_packed(ptr, *warrior._packed)
+            return
         for (i, inst) in enumerate(warrior.initial_program(ptr)):
             if inst is not None:
-                self.write(ptr + i, inst)
+                self.write(ptr + i, inst.copy(self.size))
+
+    def _load_packed(self, ptr, data, offset, length):
+        """Writes `length` instructions packed in a binary load file."""
+        size = self.size
+        for (i, fields) in enumerate(_unpack_program(data, offset, length)):
+            (opcode, modifier, A_mode, A_value, B_mode, B_value) = fields
+            self.write(ptr + i, Instruction.from_fields(opcode, modifier,
+                    A_mode, fold(A_value, size), B_mode, fold(B_value, size)))
+
+def _column(name, folded=False):
+    """Property of MemoryCell standing for the `name` column of the memory.
+    If `folded`, the values are reduced modulo the size."""
+    def get(self):
+        return getattr(self._memory, name)[self._ptr]
+    def set(self, value):
+        if folded:
+            value = fold(value, self._memory._size)
+        getattr(self._memory, name)[self._ptr] = value
+    return property(get, set)
+
+class MemoryCell(Instruction):
+    """A view on a cell of an ArrayMemory. Reading and writing its
+    attributes reads and writes the columns of the memory."""
+    __slots__ = ('_memory', '_ptr')
+    def __init__(self, memory, ptr):
+        self._memory = memory
+        self._ptr = ptr
+
+    _opcode = _column('_opcodes')
+    _modifier = _column('_modifiers')
+    _A_mode = _column('_A_modes')
+    _A_value = _column('_A_values', folded=True)
+    _B_mode = _column('_B_modes')
+    _B_value = _column('_B_values', folded=True)
+    _id = _column('_ids')
+    @property
+    def _direct(self):
+        (memory, ptr) = (self._memory, self._ptr)
+        return memory._A_modes[ptr] <= DIRECT and \
+                memory._B_modes[ptr] <= DIRECT
+    def _decode(self):
+        self._id = _decode_ids(self._opcode, self._modifier,
+                self._A_mode, self._B_mode)
+
+class ArrayMemory(Memory):
+    """Memory backend storing each field of the instructions in its own
+    array, instead of one Instruction object per cell.
+
+    `read` returns MemoryCell views instead of the instructions that were
+    written, and values are always stored reduced modulo the size."""
+    def __init__(self, size):
+        if not isinstance(size, int):
+            raise ValueError('Memory size must be an integer, not %r' % size)
+        self._size = size
+        (self._opcodes, self._modifiers, self._A_modes, self._A_values,
+                self._B_modes, self._B_values, self._ids) = \
+                self._blank_columns()
+        self._loaded_warriors = {}
+        self._callbacks = []
+        self._batch_callbacks = []
+        self._changes = {}
+        self._lock = threading.RLock()
+
+    @property
+    def as_list(self):
+        return [MemoryCell(self, ptr) for ptr in xrange(0, self.size)]
+
+    @cfunc(ptr=int)
+    def read(self, ptr):
+        if STRICT and not isinstance(ptr, int):
+            raise ValueError('Pointer must be an integer, not %r' % ptr)
+        return MemoryCell(self, ptr % self.size)
+    @cfunc(ptr=int)
+    def write(self, ptr, instruction=None, **kwargs):
+        old_instruction = cvar(object)
+        if STRICT and not isinstance(ptr, int):
+            raise ValueError('Pointer must be an integer, not %r' % ptr)
+        ptr %= self.size
+        if instruction is not None:
+            if not isinstance(instruction, Instruction):
+                raise TypeError('The instruction parameter must be an '
+                        'Instruction instance')
+            if STRICT and kwargs != {}:
+                raise ValueError('Cannot supply extra attribute if '
+                        'instruction is given')
+            kwargs = dict(zip(SYNTAX.fields, instruction.fields))
+        else:
+            for key in kwargs:
+                if key not in SYNTAX.data_blocks and \
+                        key not in SYNTAX.fields:
+                    raise ValueError('%r is not a valid data block.' % key)
+        cell = MemoryCell(self, ptr)
+        with self._lock:
+            if self._callbacks:
+                old_instruction = cell.copy()
+            old_opcode = self._opcodes[ptr]
+            self._unlocked_write(ptr, **kwargs)
+            if self._journal is not None:
+                self._journal_cell(ptr)
+            if self._batch_callbacks:
+                self._record(ptr, SYNTAX.opcodes[old_opcode], cell.opcode)
+        for callback in self._callbacks:
+            callback(ptr, old_instruction, cell)
+
+    def _blank_columns(self):
+        """Returns columns filled with DAT.F $0, $0."""
+        size = self._size
+        # Reduced values are in ]-size/2, size/2]
+        value_type = 'h' if size <= 65535 else 'i'
+        return (array.array('B', [_opcode_ids['DAT']]) * size,
+                array.array('B', [_modifier_ids[None]]) * size,
+                array.array('B', [DIRECT]) * size,
+                array.array(value_type, [0]) * size,
+                array.array('B', [DIRECT]) * size,
+                array.array(value_type, [0]) * size,
+                array.array('B', [decode('DAT', None, DIRECT, DIRECT)]) * size)
+
+    def _columns(self):
+        return (self._opcodes, self._modifiers, self._A_modes, self._A_values,
+                self._B_modes, self._B_values, self._ids)
+
+    def snapshot(self):
+        """Returns a copy of the columns of the memory, which can be given
+        to `restore`."""
+        with self._lock:
+            return tuple([x[:] for x in self._columns()])
+
+    def restore(self, snapshot):
+        """Restores the content of the memory from a snapshot, with bulk
+        copies of the columns. Callbacks are called for the cells which
+        changed."""
+        columns = self._columns()
+        if len(snapshot) != len(columns) or len(snapshot[0]) != self._size:
+            raise ValueError('The snapshot is not one of a memory of size %i.'
+                    % self._size)
+        with self._lock:
+            if self._callbacks or self._batch_callbacks:
+                (opcodes, modifiers, A_modes, A_values, B_modes, B_values) = \
+                        snapshot[0:6]
+                for ptr in xrange(0, self._size):
+                    if any([x[ptr] != y[ptr]
+                            for (x, y) in zip(columns, snapshot)]):
+                        self.write(ptr, opcode=SYNTAX.opcodes[opcodes[ptr]],
+                                modifier=_modifiers_by_id[modifiers[ptr]],
+                                A_mode=A_modes[ptr], A_value=A_values[ptr],
+                                B_mode=B_modes[ptr], B_value=B_values[ptr])
+            else:
+                # Bulk copies
+                for (column, saved) in zip(columns, snapshot):
+                    column[:] = saved
+        self.flush_changes()
+
+    def clear(self):
+        if self._callbacks or self._batch_callbacks:
+            Memory.clear(self)
+            return
+        with self._lock:
+            for (column, blank) in zip(self._columns(),
+                                       self._blank_columns()):
+                column[:] = blank
+
+    def _load_packed(self, ptr, data, offset, length):
+        if self._callbacks or self._batch_callbacks:
+            Memory._load_packed(self, ptr, data, offset, length)
+            return
+        # No observer: unpack straight into the columns.
+        size = self._size
+        unpack = _load_file_instruction.unpack_from
+        step = _load_file_instruction.size
+        with self._lock:
+            for i in xrange(0, length):
+                (opcode, modifier, A_mode, B_mode, A_value, B_value) = \
+                        unpack(data, offset + i*step)
+                cell = (ptr + i) % size
+                self._opcodes[cell] = opcode
+                self._modifiers[cell] = modifier
+                self._A_modes[cell] = A_mode
+                self._A_values[cell] = fold(A_value, size)
+                self._B_modes[cell] = B_mode
+                self._B_values[cell] = fold(B_value, size)
+                self._ids[cell] = decode(SYNTAX.opcodes[opcode],
+                        _modifiers_by_id[modifier], A_mode, B_mode)
+
+    @cfunc(ptr=int)
+    def _unlocked_read(self, ptr):
+        return MemoryCell(self, ptr % self._size)
+    @cfunc(ptr=int)
+    def _unlocked_write(self, ptr, instruction=None, **kwargs):
+        cell = MemoryCell(self, ptr % self._size)
+        if instruction is not None:
+            kwargs = dict(zip(SYNTAX.fields, instruction.fields))
+        for (key, value) in kwargs.items():
+            setattr(cell, key, value)
+    @cfunc(ptr=int, value=int)
+    def _unlocked_set_a(self, ptr, value):
+        self._A_values[ptr % self._size] = fold(value, self._size)
+    @cfunc(ptr=int, value=int)
+    def _unlocked_set_b(self, ptr, value):
+        self._B_values[ptr % self._size] = fold(value, self._size)
+    @cfunc(source=int, dest=int)
+    def _unlocked_copy_cell(self, source, dest):
+        (source, dest) = (source % self._size, dest % self._size)
+        for column in self._columns():
+            column[dest] = column[source]
+    @cfunc(ptr=int, value=int)
+    def _journaled_set_a(self, ptr, value):
+        ptr %= self._size
+        value = fold(value, self._size)
+        self._A_values[ptr] = value
+        self._journal.extend((ptr, value))
+    @cfunc(ptr=int, value=int)
+    def _journaled_set_b(self, ptr, value):
+        ptr %= self._size
+        value = fold(value, self._size)
+        self._B_values[ptr] = value
+        self._journal.extend((ptr + self._size, value))
 
 class MarsProperties(object):
     def __init__(self, **kwargs):
@@ -526,6 +1284,7 @@ class MarsProperties(object):
                 'maxprocesses': 8000,
                 'maxlength': 100,
                 'mindistance': 100,
+                'pspacesize': 500,
                 }
         for key in kwargs:
             if STRICT and key not in self._data:
@@ -539,11 +1298,210 @@ class MarsProperties(object):
     def as_dict(self):
         return self._data.copy()
 
+@cfunc(size=int, coresize=int)
+def _new_pspace(size, coresize):
+    """Returns an empty P-space. Its location 0, which holds the result of
+    the previous round, is -1 (ie. coresize-1) until a round is over."""
+    pspace = array.array('H' if coresize <= 65536 else 'I', [0]) * size
+    pspace[0] = coresize - 1
+    return pspace
+
+class Placements(object):
+    """Table of the load positions of a number of warriors, one row per
+    round. Positions are relative to the first warrior, which is always
+    at 0, and (except for `fixed`) two warriors are at least `mindistance`
+    cells apart.
+
+    A table is built once with `fixed`, `random` or `exhaustive`, and can
+    then be iterated over as many times as needed, eg. to give the same
+    positions to each pair of warriors of a tournament."""
+    def __init__(self, warriors, rows):
+        self._warriors = warriors
+        self._positions = array.array('i')
+        for row in rows:
+            if len(row) != warriors:
+                raise ValueError('%r does not have %i positions.' %
+                        (row, warriors))
+            self._positions.extend(row)
+
+    @property
+    def warriors(self):
+        """Number of warriors of each row."""
+        return self._warriors
+
+    def __len__(self):
+        return len(self._positions) // self._warriors
+
+    def __getitem__(self, round_):
+        if not 0 <= round_ < len(self):
+            raise IndexError('No round %i in the placement table.' % round_)
+        start = round_ * self._warriors
+        return tuple(self._positions[start:start+self._warriors])
+
+    def __iter__(self):
+        for round_ in xrange(0, len(self)):
+            yield self[round_]
+
+    @classmethod
+    def fixed(cls, warriors, properties, rounds=1):
+        """Places the warriors one after the other, `maxlength +
+        mindistance` cells apart, like Mars.load does."""
+        separation = properties.maxlength + properties.mindistance
+        row = [i * separation for i in xrange(0, warriors)]
+        return cls(warriors, [row] * rounds)
+
+    @classmethod
+    def random(cls, warriors, properties, rounds, seed=None):
+        """Draws the positions of each round at random. The table only
+        depends on the seed."""
+        (size, distance) = (properties.coresize, properties.mindistance)
+        _check_placement(warriors, size, distance)
+        rand = random.Random(seed)
+        rows = []
+        for round_ in xrange(0, rounds):
+            row = [0]
+            while len(row) < warriors:
+                ptr = rand.randint(distance, size - distance)
+                if all([distance <= (ptr - x) % size <= size - distance
+                        for x in row]):
+                    row.append(ptr)
+            rows.append(row)
+        return cls(warriors, rows)
+
+    @classmethod
+    def exhaustive(cls, warriors, properties):
+        """Enumerates all the valid positions, the warriors being in the
+        order they are given. For two warriors, this is every offset of
+        the second one between `mindistance` and `coresize -
+        mindistance`."""
+        (size, distance) = (properties.coresize, properties.mindistance)
+        _check_placement(warriors, size, distance)
+        def rows(row):
+            if len(row) == warriors:
+                yield row
+                return
+            # Leave room for the remaining warriors before wrapping to 0
+            last = size - distance * (warriors - len(row))
+            for ptr in xrange(row[-1] + distance, last + 1):
+                for x in rows(row + [ptr]):
+                    yield x
+        return cls(warriors, rows([0]))
+
+def _check_placement(warriors, size, distance):
+    if warriors < 1:
+        raise ValueError('At least one warrior must be placed.')
+    if warriors * distance > size or distance < 1:
+        raise ValueError('%i warriors cannot be %i cells apart in a memory '
+                'of size %i.' % (warriors, distance, size))
+
+BattleResult = collections.namedtuple('BattleResult',
+        'warriors cycles winners deaths processes')
+BattleResult.__doc__ = """Result of Mars.run_battle. `deaths` and
+`processes` are the cycle of death and the final number of processes of
+each of the `warriors`, and `winners` the list of surviving warriors."""
+
+# Points of the winner of a round, and of each warrior of a tie
+WIN = 3
+TIE = 1
+
+RoundResult = collections.namedtuple('RoundResult',
+        'round winner deaths cycles tie scores decided')
+RoundResult.__doc__ = """Result of a round of Mars.match. `deaths` and
+`scores` (the total after this round) follow the order of the warriors
+given to match. `winner` is the only survivor, if any; `tie` is True if
+several warriors survived `maxcycles` cycles or died during the last
+cycle. `decided` is True if the result of the match is known, either
+because it was the last round or because no warrior can catch up with the
+leader anymore."""
+
+Snapshot = collections.namedtuple('Snapshot',
+        'memory warriors threads pspaces cycles')
+Snapshot.__doc__ = """State of a Mars, returned by Mars.snapshot. `warriors`
+are the warriors alive, in the order they run, `threads` their process
+queues and `pspaces` copies of their P-spaces."""
+
+class Statistics(object):
+    """Profiling counters of a Mars, see Mars.enable_statistics.
+
+    It is a Mars observer, which counts the instructions executed per
+    opcode and modifier, and the instructions executed and the cells
+    written by each warrior. Every `interval` cycles, the length of the
+    process queues and the wall-clock time since the previous sample are
+    recorded."""
+    def __init__(self, memory, interval=100):
+        self._memory = memory
+        self._interval = interval
+        self._cycles = 0
+        self._instructions = [0] * len(_dispatch)
+        # Warriors, in the order they first ran, and their counters
+        self._warriors = []
+        self._indexes = {}
+        self._steps = []
+        self._writes = []
+        self._processes = []
+        self._times = []
+        self._last_sample = time.time()
+        memory.add_callback(self._on_write)
+
+    def _index(self, warrior):
+        index = self._indexes.get(id(warrior))
+        if index is None:
+            index = self._indexes[id(warrior)] = len(self._warriors)
+            self._warriors.append(warrior)
+            self._steps.append(0)
+            self._writes.append(0)
+            self._processes.append([])
+        return index
+
+    def _on_write(self, ptr, old, new):
+        owner = self._memory._owner
+        if owner is not None:
+            self._writes[self._index(owner)] += 1
+
+    def step(self, warrior, memory):
+        """Called before the warrior runs its next process."""
+        self._steps[self._index(warrior)] += 1
+        self._instructions[memory.read(warrior._threads[0])._id] += 1
+
+    def end_cycle(self):
+        self._cycles += 1
+        if self._cycles % self._interval == 0:
+            now = time.time()
+            self._times.append(now - self._last_sample)
+            self._last_sample = now
+            for (samples, warrior) in zip(self._processes, self._warriors):
+                samples.append(len(warrior._threads))
+
+    @property
+    def as_dict(self):
+        """The counters, as a dict which can be dumped as JSON."""
+        instructions = {}
+        for (id_, count) in enumerate(self._instructions):
+            if count:
+                (opcode, modifier) = _dispatch[id_][0:2]
+                instructions['%s.%s' % (opcode, modifier)] = count
+        return {'cycles': self._cycles,
+                'interval': self._interval,
+                'instructions': instructions,
+                'time': list(self._times),
+                'warriors': [{'name': str(warrior),
+                              'instructions': steps,
+                              'writes': writes,
+                              'processes': list(processes)}
+                             for (warrior, steps, writes, processes)
+                             in zip(self._warriors, self._steps,
+                                    self._writes, self._processes)],
+                }
+
 class Mars(object):
-    def __init__(self, properties):
+    def __init__(self, properties, memory_class=Memory):
         self._properties = properties
-        self._memory = Memory(properties.coresize)
+        self._memory = memory_class(properties.coresize)
         self._warriors = []
+        self._cycles = 0
+        self._statistics = None
+        self._observers = []
+        self._recorder = None
 
     @property
     def memory(self):
@@ -557,34 +1515,316 @@ class Mars(object):
     def warriors(self):
         return self._warriors
 
-    def load(self, warrior):
-        self._memory.load(len(self.warriors) *
-                (self._properties.maxlength + self._properties.mindistance),
-                warrior)
+    @property
+    def cycles(self):
+        """Number of cycles run so far."""
+        return self._cycles
+
+    @property
+    def statistics(self):
+        """The Statistics of the Mars, or None if they are disabled."""
+        return self._statistics
+
+    def enable_statistics(self, interval=100):
+        """Starts collecting profiling counters, and returns the Statistics
+        instance. Until it is called, the counters cost nothing."""
+        if self._statistics is None:
+            self._statistics = Statistics(self._memory, interval)
+            self.add_observer(self._statistics)
+        return self._statistics
+
+    def add_observer(self, observer):
+        """Registers an object whose `step(warrior, memory)` method is
+        called before each step, and `end_cycle()` method after each
+        cycle. Without observers, the Mars does not pay for them."""
+        if not self._observers:
+            self.run = self._observed_run
+            self.cycle = self._observed_cycle
+        self._observers.append(observer)
+    def remove_observer(self, observer):
+        self._observers.remove(observer)
+        if not self._observers:
+            del self.run
+            del self.cycle
+
+    def _check_snapshots(self):
+        if not isinstance(self._memory, ArrayMemory):
+            raise TypeError('Snapshots require the ArrayMemory backend, '
+                    'not %s.' % type(self._memory).__name__)
+
+    def snapshot(self):
+        """Returns a snapshot of the memory, of the process queues and the
+        P-spaces of the warriors, and of the cycle counter. The memory
+        must be an ArrayMemory (see the `memory_class` parameter), whose
+        columns are copied and restored in bulk."""
+        self._check_snapshots()
+        return Snapshot(self._memory.snapshot(), tuple(self._warriors),
+                tuple([tuple(x._threads) for x in self._warriors]),
+                tuple([x._pspace and x._pspace[:] for x in self._warriors]),
+                self._cycles)
+
+    def restore(self, snapshot):
+        """Puts the Mars back in the state of a snapshot. The warriors
+        which died since then are brought back to life."""
+        self._check_snapshots()
+        self._memory.restore(snapshot.memory)
+        for (warrior, threads, pspace) in zip(snapshot.warriors,
+                snapshot.threads, snapshot.pspaces):
+            warrior._threads = collections.deque(threads)
+            warrior._pspace = pspace and pspace[:]
+        self._warriors = list(snapshot.warriors)
+        self._cycles = snapshot.cycles
+
+    def load(self, warrior, ptr=None):
+        """Loads a warrior at `ptr`, or after the previously loaded
+        warriors if it is not given. A warrior loaded again starts over
+        with a single process."""
+        if ptr is None:
+            ptr = len(self.warriors) * \
+                (self._properties.maxlength + self._properties.mindistance)
+        warrior.maxprocesses = self._properties.maxprocesses
+        warrior._threads = None
+        pspace = warrior._pspace
+        if pspace is None or len(pspace) != self._properties.pspacesize:
+            warrior._pspace = _new_pspace(self._properties.pspacesize,
+                    self._properties.coresize)
+        self._memory._owner = warrior
+        try:
+            self._memory.load(ptr, warrior)
+        finally:
+            self._memory._owner = None
+        self._memory.flush_changes()
         self._warriors.append(warrior)
 
+    def reset(self):
+        """Empties the memory and unloads the warriors, so the Mars can
+        be used for another round."""
+        self._memory.clear()
+        self._warriors = []
+        self._cycles = 0
+
+    def place(self, warriors, positions):
+        """Resets the Mars, and loads the `warriors` at `positions`, eg. a
+        row of a Placements table, shifted by a random offset or not."""
+        if len(warriors) != len(positions):
+            raise ValueError('%i warriors, but %i positions.' %
+                    (len(warriors), len(positions)))
+        self.reset()
+        for (warrior, ptr) in zip(warriors, positions):
+            self.load(warrior, ptr)
+
+    def match(self, warriors, rounds, seed=None, early_exit=True):
+        """Runs up to `rounds` rounds of the `warriors`, with random
+        positions (see Placements.random), and yields a RoundResult after
+        each of them. The warriors run first in turn.
+
+        If `early_exit` is True, the match stops as soon as the leader
+        cannot be caught up with in the remaining rounds."""
+        count = len(warriors)
+        placements = Placements.random(count, self._properties, rounds, seed)
+        scores = [0] * count
+        for (round_, positions) in enumerate(placements):
+            # order[k] is the index of the warrior loaded at positions[k]
+            order = [(k + round_) % count for k in xrange(0, count)]
+            self.place([warriors[i] for i in order], positions)
+            result = self.run_battle()
+            alive = set([id(x) for x in result.winners])
+            for warrior in result.warriors:
+                # Number of survivors, or 0 for the dead
+                warrior._pspace[0] = len(alive) if id(warrior) in alive else 0
+            deaths = [None] * count
+            for (k, death) in zip(order, result.deaths):
+                deaths[k] = death
+            if result.winners:
+                survivors = [i for i in xrange(0, count)
+                             if deaths[i] is None]
+            else:
+                survivors = [i for i in xrange(0, count)
+                             if deaths[i] == result.cycles]
+            winner = None
+            if len(survivors) == 1:
+                winner = warriors[survivors[0]]
+                scores[survivors[0]] += WIN
+            else:
+                for i in survivors:
+                    scores[i] += TIE
+            left = rounds - round_ - 1
+            leader = max(scores)
+            decided = left == 0 or (scores.count(leader) == 1 and
+                    all([x + left * WIN < leader
+                         for x in scores if x != leader]))
+            yield RoundResult(round_, winner, deaths, result.cycles,
+                    len(survivors) > 1, list(scores), decided)
+            if decided and early_exit:
+                return
+
+    def run_battle(self, max_cycles=None):
+        """Runs the battle until at most one warrior is left (or none, if
+        only one was loaded), or until `max_cycles` (defaults to the
+        `maxcycles` property) cycles are run.
+
+        This is the fast path for battles without observer: the memory
+        is accessed without locks nor callbacks, and the instructions run
+        without strict checks (which were already done when loading the
+        warriors). The module-wide STRICT flag is left untouched."""
+        if max_cycles is None:
+            max_cycles = self._properties.maxcycles
+        warriors = list(self._warriors)
+        deaths = [None] * len(warriors)
+        memory = self._memory
+        left = 1 if len(warriors) > 1 else 0
+        cycle = 0
+        observers = self._observers
+        observed = bool(memory._batch_callbacks) or bool(observers)
+        journal = memory._journal
+        try:
+            with memory.fast_path():
+                while cycle < max_cycles and len(self._warriors) > left:
+                    cycle += 1
+                    for (i, warrior) in enumerate(warriors):
+                        if observed:
+                            memory._owner = warrior
+                            if deaths[i] is None:
+                                for observer in observers:
+                                    observer.step(warrior, memory)
+                        if deaths[i] is None and \
+                                not warrior.run(memory, False, journal):
+                            deaths[i] = cycle
+                            self._warriors = [x for (j, x)
+                                    in enumerate(warriors)
+                                    if deaths[j] is None]
+                    if journal is not None:
+                        journal.append(-1)
+                        if len(journal) >= JOURNAL_SIZE:
+                            self._recorder.flush()
+                    if observed:
+                        memory.flush_changes()
+                        for observer in observers:
+                            observer.end_cycle()
+        finally:
+            memory._owner = None
+            self._cycles += cycle
+        return BattleResult(warriors, cycle, list(self._warriors), deaths,
+                [len(x._threads) for x in warriors])
+
     def run(self):
         warrior = self._warriors.pop(0)
+        self._memory._owner = warrior
         try:
-            alive = warrior.run(self._memory)
+            alive = warrior.run(self._memory, True, self._memory._journal)
         except KeyboardInterrupt as e:
             self._warriors.append(warrior)
             raise e
+        finally:
+            self._memory._owner = None
         if alive:
             self._warriors.append(warrior)
         else:
             return warrior
     def cycle(self):
+        self._cycles += 1
         warriors = []
         for i in xrange(0, len(self._warriors)):
             warrior = self.run()
             if warrior is not None: # Warrior died
                 warriors.append(warrior)
+        journal = self._memory._journal
+        if journal is not None:
+            journal.append(-1)
+            if len(journal) >= JOURNAL_SIZE:
+                self._recorder.flush()
+        self._memory.flush_changes()
+        return warriors
+
+    def _observed_run(self):
+        for observer in self._observers:
+            observer.step(self._warriors[0], self._memory)
+        return Mars.run(self)
+    def _observed_cycle(self):
+        warriors = Mars.cycle(self)
+        for observer in self._observers:
+            observer.end_cycle()
         return warriors
 
+class ThreadsView(object):
+    """Read-only view on the process queue of a warrior."""
+    def __init__(self, threads):
+        self._threads = threads
+
+    def __len__(self):
+        return len(self._threads)
+    def __iter__(self):
+        return iter(self._threads)
+    def __getitem__(self, index):
+        return self._threads[index]
+    def __contains__(self, ptr):
+        return ptr in self._threads
+
+    def __eq__(self, other):
+        if isinstance(other, ThreadsView):
+            other = other._threads
+        return list(self._threads) == list(other)
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    def __repr__(self):
+        return '<%s.%s %r>' % (self.__class__.__module__,
+                self.__class__.__name__, list(self._threads))
+
+# Binary load files: a fixed-size header (magic, origin, number of
+# instructions, lengths of the name and of the author), the packed
+# instructions, and then the name and the author, encoded in UTF-8.
+LOAD_FILE_MAGIC = b'VMRB'
+_load_file_header = struct.Struct('<4siIHH')
+_load_file_instruction = struct.Struct('<BBBBii')
+
+def dump_load_file(fd, program, origin=None, name=None, author=None):
+    """Writes a binary load file to `fd`, a seekable file object opened
+    in binary mode.
+
+    `program` is an iterable of instructions, consumed lazily. If `origin`,
+    `name` or `author` is not given, the attribute of `program` with the
+    same name is used once it is consumed, so an assembly stream can be
+    written while it is assembled."""
+    start = fd.tell()
+    fd.write(_load_file_header.pack(LOAD_FILE_MAGIC, 0, 0, 0, 0))
+    pack = _load_file_instruction.pack
+    length = 0
+    for inst in program:
+        fd.write(pack(inst._opcode, inst._modifier, inst._A_mode,
+                      inst._B_mode, inst._A_value, inst._B_value))
+        length += 1
+    if origin is None:
+        origin = getattr(program, 'origin', None) or 0
+    name = (name or getattr(program, 'name', None) or '').encode('utf8')
+    author = (author or getattr(program, 'author', None) or '').encode('utf8')
+    fd.write(name + author)
+    end = fd.tell()
+    fd.seek(start)
+    fd.write(_load_file_header.pack(LOAD_FILE_MAGIC, origin, length,
+                                    len(name), len(author)))
+    fd.seek(end)
+
+def _unpack_program(data, offset, length):
+    """Yields the fields of the instructions packed in a binary load
+    file."""
+    unpack = _load_file_instruction.unpack_from
+    step = _load_file_instruction.size
+    for i in xrange(0, length):
+        (opcode, modifier, A_mode, B_mode, A_value, B_value) = \
+                unpack(data, offset + i*step)
+        yield (SYNTAX.opcodes[opcode], _modifiers_by_id[modifier],
+               A_mode, A_value, B_mode, B_value)
+
 class Warrior(object):
     name = None
     author = None
+    # (buffer, offset, length) of the instructions of a binary load file
+    _packed = None
+    # Maximum number of processes, set when loaded in a Mars. None means
+    # there is no limit.
+    maxprocesses = None
+    # P-space, created when the warrior is first loaded in a Mars
+    _pspace = None
     def __init__(self, program='', origin=None):
         if origin is not None:
             if STRICT and not isinstance(program, list):
@@ -621,31 +1861,112 @@ class Warrior(object):
     def __eq__(self, other):
         if not isinstance(other, Warrior):
             return False
-        return self._initial_program == other._initial_program
+        return self.program == other.program
 
     def __str__(self):
         return '%s by %s' % (self.name or 'unnamed warrior',
                 self.author or 'anonymous')
 
+    @classmethod
+    def from_binary(cls, data, offset=0):
+        """Builds a warrior from a binary load file, given as bytes or as
+        any buffer (eg. a mmap). Instructions are not decoded until the
+        program is accessed; Memory.load unpacks them straight into the
+        core. The packed program is copied, so the buffer can be closed
+        afterward."""
+        (magic, origin, length, name_length, author_length) = \
+                _load_file_header.unpack_from(data, offset)
+        if magic != LOAD_FILE_MAGIC:
+            raise ValueError('%r is not a binary load file.' % data[0:16])
+        warrior = cls.__new__(cls)
+        warrior._origin = origin
+        warrior._initial_program = None
+        warrior._threads = None
+        offset += _load_file_header.size
+        end = offset + length * _load_file_instruction.size
+        warrior._packed = (bytes(data[offset:end]), 0, length)
+        offset = end
+        if name_length:
+            warrior.name = bytes(data[offset:offset+name_length]) \
+                    .decode('utf8')
+        offset += name_length
+        if author_length:
+            warrior.author = bytes(data[offset:offset+author_length]) \
+                    .decode('utf8')
+        return warrior
+
+    @classmethod
+    def from_file(cls, path):
+        """Builds a warrior from a load file, either text or binary.
+        Binary load files are memory-mapped."""
+        with open(path, 'rb') as fd:
+            if fd.read(len(LOAD_FILE_MAGIC)) != LOAD_FILE_MAGIC:
+                fd.seek(0)
+                program = fd.read()
+                if not isinstance(program, str): # Python 3
+                    program = program.decode('utf8')
+                return cls(program)
+            data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls.from_binary(data)
+        finally:
+            data.close()
+
+    @property
+    def origin(self):
+        return self._origin
+
+    @property
+    def program(self):
+        """The list of instructions of the warrior, as it was loaded."""
+        if self._initial_program is None:
+            self._initial_program = [Instruction.from_fields(*x)
+                    for x in _unpack_program(*self._packed)]
+        return self._initial_program
+
     @property
     def threads(self):
-        return [x for x in self._threads] # Shallow copy
+        return ThreadsView(self._threads)
 
-    def initial_program(self, ptr=None):
+    @property
+    def pspace(self):
+        """The P-space of the warrior (an array, values being reduced
+        modulo the size of the memory), or None if it was never loaded in
+        a Mars. It is kept when the warrior is loaded again, so it is
+        carried over between rounds."""
+        return self._pspace
+
+    def _start(self, ptr):
         if STRICT and (self._threads is None) and (ptr is None):
             raise ValueError('The load pointer must be provided before '
                     'accessing the program.')
         elif self._threads is None:
-            self._threads = [ptr+self._origin]
-        return self._initial_program
+            self._threads = collections.deque([ptr+self._origin])
+
+    def initial_program(self, ptr=None):
+        self._start(ptr)
+        return self.program
 
-    def run(self, memory):
-        assert self._threads != [], 'Attempted to run a died warrior.'
-        ptr = self._threads.pop(0)
+    def run(self, memory, strict=True, journal=None):
+        """Runs the next process of the warrior, and returns whether the
+        warrior is still alive. If `strict` is false, STRICT checks are
+        skipped. The end of the step is appended to the `journal` of the
+        memory, if it is given."""
+        threads = self._threads
+        assert threads, 'Attempted to run a died warrior.'
+        ptr = threads.popleft()
         inst = memory.read(ptr)
-        new_threads = inst.run(memory, ptr)
-        if STRICT and not isinstance(new_threads, list):
+        memory._pspace = self._pspace
+        new_threads = inst.run(memory, ptr, strict)
+        if strict and STRICT and not isinstance(new_threads, list):
             raise ValueError('Instruction.run must return a list, not %r.' %
                     new_threads)
-        self._threads.extend(new_threads)
-        return (self._threads != []) # True if warrior is still alive
+        if self.maxprocesses is not None and \
+                len(threads) + len(new_threads) > self.maxprocesses:
+            # The queue is full: processes created by SPL are dropped
+            new_threads = new_threads[0:self.maxprocesses - len(threads)]
+        threads.extend(new_threads)
+        if journal is not None:
+            journal.append(-2 - len(new_threads))
+            journal.extend(new_threads)
+        return len(threads) != 0 # True if warrior is still alive
@@ -23,12 +23,17 @@ __all__ = ['CallbackApplication']
 from PyQt4 import QtGui, QtCore
 
 class CallbackApplication(QtGui.QApplication):
+    """Application running `callback(*args)` in a worker thread while the
+    event loop runs. The application quits when the callback returns."""
     def exec_(self, callback, args):
         self._thread = Thread()
         self._thread.callback = callback
         self._thread.args = args
+        self._thread.finished.connect(self.quit)
         self._thread.start()
-        super(CallbackApplication, self).exec_()
+        result = super(CallbackApplication, self).exec_()
+        self._thread.wait()
+        return result
 
 class Thread(QtCore.QThread):
     def run(self):
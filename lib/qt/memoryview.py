@@ -21,12 +21,15 @@
 __all__ = ['MemoryView']
 
 import math
-import threading
 import collections
 
 from PyQt4 import QtCore, QtGui
 
+if 'xrange' not in globals(): # Python 3
+    xrange = range
+
 CELL_SIZE = 5.0 # Used for float division
+FRAME_RATE = 30 # Maximum number of refreshes per second
 
 def exitOnKeyboardInterrupt(f):
     def newf(*args, **kwargs):
@@ -54,12 +57,13 @@ opcode2color = {
     'JMN': QtCore.Qt.darkMagenta,
     'DJN': QtCore.Qt.darkMagenta,
     # Skips
+    'CMP': QtCore.Qt.magenta,
     'SEQ': QtCore.Qt.magenta,
     'SNE': QtCore.Qt.magenta,
-    'SLI': QtCore.Qt.magenta,
+    'SLT': QtCore.Qt.magenta,
     # P-space
     'LDP': QtCore.Qt.lightGray,
-    'SDP': QtCore.Qt.lightGray,
+    'STP': QtCore.Qt.lightGray,
     # Split
     'SPL': QtCore.Qt.black,
     # Nop
@@ -67,73 +71,76 @@ opcode2color = {
 }
 
 class MemoryView(QtGui.QLabel):
+    """Displays the opcodes of a memory.
+
+    Memory changes, which are received in batches at the end of each cycle
+    and may come from another thread, are only published in a bounded queue
+    of dirty cells. The queue is drained and the dirty
+    cells painted in one batch, at most FRAME_RATE times per second, so the
+    speed of the simulation does not depend on how often cells change. If
+    the queue overflows between two frames, the whole memory is painted
+    again from its current state."""
     def __init__(self, memory, parent=None):
         super(MemoryView, self).__init__(parent)
         self._memory = memory
-        self._memory.add_callback(self.onMemoryUpdate)
-        self.painting = threading.Lock()
-        self._paint_queue = collections.deque()
+        # deque.extend and deque.popleft are thread-safe, no lock is needed.
+        self._changes = collections.deque(maxlen=memory.size)
+        self._overflow = False
+        self._memory.add_callback(self.onMemoryUpdate, batch=True)
         if parent is None:
             self.resize(700, 500)
-        self._image = QtGui.QPixmap(self.width(), self.height())
+        self._image = QtGui.QImage(self.width(), self.height(),
+                QtGui.QImage.Format_ARGB32)
         self._image.fill(QtCore.Qt.transparent)
-        self._painter = QtGui.QPainter()
-        self._cache = collections.deque(maxlen=100)
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self.flush)
 
     def show(self):
         super(MemoryView, self).show()
         self.resizeEvent()
         self.redraw()
+        self._timer.start(1000 // FRAME_RATE)
 
     def resizeEvent(self, resizeEvent=None):
         self.cols = math.floor((self.width())/CELL_SIZE) - 1
         self.lines = math.ceil(self._memory.size/float(self.cols))
 
     def redraw(self):
-        with self.painting:
-            for ptr, instruction in enumerate(self._memory.as_list):
-                self.drawInstruction(ptr, instruction, True)
-            self.setPixmap(self._image)
+        """Paints the whole memory."""
+        self._overflow = True
+        self.flush()
 
     @exitOnKeyboardInterrupt
-    def paintEvent(self, event):
-        super(MemoryView, self).paintEvent(event)
-        self._draw(self)
+    def flush(self):
+        """Paints the dirty cells."""
+        changes = self._changes
+        if self._overflow:
+            self._overflow = False
+            changes.clear()
+            dirty = xrange(0, self._memory.size)
+        else:
+            dirty = set([changes.popleft() for x in xrange(0, len(changes))])
+        if not dirty:
+            return
+        painter = QtGui.QPainter(self._image)
+        try:
+            for ptr in dirty:
+                painter.fillRect(self._rectangle(ptr),
+                        opcode2color[self._memory.read(ptr).opcode])
+        finally:
+            painter.end()
+        self.setPixmap(QtGui.QPixmap.fromImage(self._image))
 
-    @exitOnKeyboardInterrupt
-    def drawInstruction(self, ptr, instruction, init):
-        rectangle = QtCore.QRect(
+    def _rectangle(self, ptr):
+        return QtCore.QRect(
                  (ptr % self.cols)*CELL_SIZE,
                  math.floor(ptr/float(self.cols))*CELL_SIZE,
                  CELL_SIZE,
                  CELL_SIZE)
-        color = opcode2color[instruction.opcode]
-        self._cache.append((rectangle, color))
-        if len(self._cache) == self._cache.maxlen:
-            self._draw(self._image)
-            self._cache.clear()
-            if not init:
-                self.setPixmap(self._image)
-        if not init:
-            self.repaint()
-
-    @exitOnKeyboardInterrupt
-    def _draw(self, target):
-        try:
-            self._painter.begin(target)
-            self._painter.beginNativePainting()
-            for rectangle, color in self._cache:
-                self._painter.fillRect(rectangle, color)
-        finally:
-            self._painter.endNativePainting()
-            self._painter.end()
-
-    def onMemoryUpdate(self, ptr, old_inst, new_inst):
-        if old_inst.opcode == new_inst.opcode and len(self._cache) == 0:
-            return
-        with self.painting:
-            self.drawInstruction(ptr, new_inst, False)
 
-    def __del__(self):
-        if hasattr(self, '_painter'):
-            self._painter.end()
+    def onMemoryUpdate(self, changes):
+        dirty = [ptr for (ptr, old_opcode, new_opcode, owner) in changes
+                 if old_opcode != new_opcode]
+        if len(self._changes) + len(dirty) > self._changes.maxlen:
+            self._overflow = True
+        self._changes.extend(dirty)
@@ -0,0 +1,175 @@
+# Copyright (C) 2012, Valentin Lorentz
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Round-robin tournaments, with battles run in a pool of processes."""
+
+from __future__ import print_function
+
+__all__ = ['Tournament', 'load_directory', 'run_battle']
+
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from . import core, assembler
+except (ImportError, ValueError): # Not imported from the vmars package
+    import core
+    import assembler
+
+if 'xrange' not in globals(): # Python 3
+    xrange = range
+
+WIN = core.WIN
+TIE = core.TIE
+
+def load_directory(path, properties):
+    """Returns a list of (name, load file) for all the warriors in a
+    directory. Assembly files (.red) are assembled, unless a load file (.rc,
+    or .rcb for binary ones) with the same name exists."""
+    assembler_ = assembler.Assembler(properties)
+    files = sorted(os.listdir(path))
+    warriors = []
+    for filename in files:
+        (name, extension) = os.path.splitext(filename)
+        if extension == '.rc':
+            with open(os.path.join(path, filename)) as fd:
+                warriors.append((name, fd.read()))
+        elif extension == '.rcb':
+            with open(os.path.join(path, filename), 'rb') as fd:
+                warriors.append((name, fd.read()))
+        elif extension == '.red' and name + '.rc' not in files and \
+                name + '.rcb' not in files:
+            with open(os.path.join(path, filename)) as fd:
+                (origin, load) = assembler_.assemble(fd.read(), raw=True)
+            warriors.append((name, load))
+    return warriors
+
+# Mars and warriors of the battles run by this process, so they are not
+# built again for each battle. The Mars are keyed by properties, the
+# warriors by their position in the battle and their load file.
+_mars = {}
+_warriors = {}
+
+def _get_warrior(index, program):
+    key = (index, program)
+    if key not in _warriors:
+        _warriors[key] = core.Warrior.from_binary(program) \
+                if program[0:4] == core.LOAD_FILE_MAGIC \
+                else core.Warrior(program)
+    warrior = _warriors[key]
+    warrior._pspace = None # Battles are independent
+    return warrior
+
+def run_battle(programs, offsets, properties):
+    """Runs a battle, and returns the list of the indexes of the warriors
+    which survived. The Mars is reused by the next battles with the same
+    properties, in the same process.
+
+    `properties` is a dict, so it can be sent to another process."""
+    key = tuple(sorted(properties.items()))
+    if key not in _mars:
+        _mars[key] = core.Mars(core.MarsProperties(**properties))
+    mars = _mars[key]
+    warriors = [_get_warrior(i, program)
+                for (i, program) in enumerate(programs)]
+    mars.place(warriors, offsets)
+    result = mars.run_battle()
+    return [i for (i, death) in enumerate(result.deaths) if death is None]
+
+def _run_battle(args):
+    return run_battle(*args)
+
+class Tournament(object):
+    def __init__(self, warriors, properties, rounds=1, seed=None):
+        """`warriors` is a list of (name, load file)."""
+        if not isinstance(properties, core.MarsProperties):
+            raise ValueError('`properties` must be an instance of '
+                    'core.MarsProperties, not %r' % properties)
+        self._warriors = warriors
+        self._properties = properties
+        self._rounds = rounds
+        self._seed = seed
+
+    @property
+    def warriors(self):
+        return self._warriors
+
+    def schedule(self):
+        """Returns the list of battles, as (first warrior, second warrior,
+        offset of the second warrior) tuples. The first warrior is always
+        loaded at 0.
+
+        The schedule only depends on the seed."""
+        # Each pair of warriors gets the same positions
+        placements = core.Placements.random(2, self._properties,
+                self._rounds, self._seed)
+        battles = []
+        pairs = itertools.combinations(xrange(0, len(self._warriors)), 2)
+        for (i, j) in pairs:
+            for (round_, (zero, offset)) in enumerate(placements):
+                if round_ % 2: # Alternate the warrior running first
+                    battles.append((j, i, offset))
+                else:
+                    battles.append((i, j, offset))
+        return battles
+
+    def run(self, workers=None):
+        """Runs all the battles, using `workers` processes, and returns
+        the scores as a dict of {name: {'wins': ..., 'ties': ...,
+        'losses': ..., 'score': ...}}."""
+        battles = self.schedule()
+        programs = [program for (name, program) in self._warriors]
+        properties = self._properties.as_dict
+        tasks = [((programs[i], programs[j]), (0, offset), properties)
+                 for (i, j, offset) in battles]
+        with ProcessPoolExecutor(workers) as executor:
+            outcomes = executor.map(_run_battle, tasks,
+                    chunksize=max(1, len(tasks) // 64))
+            outcomes = list(outcomes)
+
+        results = dict([(name, {'wins': 0, 'ties': 0, 'losses': 0,
+                                'score': 0})
+                        for (name, program) in self._warriors])
+        for ((i, j, offset), survivors) in zip(battles, outcomes):
+            (first, second) = (self._warriors[i][0], self._warriors[j][0])
+            if len(survivors) == 1:
+                (winner, loser) = (first, second) if survivors == [0] \
+                        else (second, first)
+                results[winner]['wins'] += 1
+                results[winner]['score'] += WIN
+                results[loser]['losses'] += 1
+            else: # Both survived, or both died during the same cycle
+                for name in (first, second):
+                    results[name]['ties'] += 1
+                    results[name]['score'] += TIE
+        return results
+
+    @staticmethod
+    def format_results(results):
+        """Returns the results as a text table, best warriors first."""
+        lines = ['%-20s %6s %6s %6s %6s' %
+                ('warrior', 'wins', 'ties', 'losses', 'score')]
+        ranking = sorted(results.items(),
+                key=lambda x:(-x[1]['score'], x[0]))
+        for (name, result) in ranking:
+            lines.append('%-20s %6i %6i %6i %6i' % (name, result['wins'],
+                result['ties'], result['losses'], result['score']))
+        return '\n'.join(lines)
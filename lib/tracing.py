@@ -0,0 +1,380 @@
+# Copyright (C) 2012, Valentin Lorentz
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Records execution traces of a Mars, and replays them.
+
+A trace file starts with a header: the size of the memory, the warriors
+with their process queues, and the content of the memory. It is followed
+by the journal of the memory (see core.Memory._journal), as 32-bit little
+endian integers: the writes of each step, the processes it created, and
+the ends of cycles. The warrior, pc and instruction of each step, and the
+old content of the cells, are not recorded: the Replay rebuilds them when
+it loads the trace. Replaying only applies the changes, forward or
+backward, without running any instruction."""
+
+from __future__ import print_function
+
+__all__ = ['TraceRecorder', 'Replay', 'TraceError']
+
+import sys
+import mmap
+import array
+import struct
+import bisect
+import collections
+
+try:
+    from . import core
+except (ImportError, ValueError): # Not imported from the vmars package
+    import core
+
+if 'xrange' not in globals(): # Python 3
+    xrange = range
+
+MAGIC = b'VMTR'
+VERSION = 3
+
+_header = struct.Struct('<4sBIH')
+_warrior = struct.Struct('<HI') # Length of the name, number of processes
+_ptr = struct.Struct('<I')
+_cell = core._load_file_instruction
+# Steps as rebuilt by the Replay: warrior, pc, handler id (ie. opcode and
+# modifier), cells changed, processes created
+_step = struct.Struct('<HIBBB')
+# Entries of the journal
+(_SET_A, _SET_B, _COPY, _CELL) = range(0, 4)
+_END_OF_CYCLE = -1
+
+def _journal_bytes(journal):
+    """Packs a list of journal entries."""
+    journal = array.array('i', journal)
+    if sys.byteorder != 'little':
+        journal.byteswap()
+    return journal.tobytes()
+
+class TraceError(Exception):
+    pass
+
+def _pack_cell(fields):
+    (opcode, modifier, A_mode, A_value, B_mode, B_value) = fields
+    return _cell.pack(core._opcode_ids[opcode], core._modifier_ids[modifier],
+                      A_mode, B_mode, A_value, B_value)
+
+def _unpack_cell(data, offset):
+    (opcode, modifier, A_mode, B_mode, A_value, B_value) = \
+            _cell.unpack_from(data, offset)
+    return (core.SYNTAX.opcodes[opcode], core._modifiers_by_id[modifier],
+            A_mode, A_value, B_mode, B_value)
+
+class TraceRecorder(object):
+    """Records the trace of the battles of `mars` to `fd`, a file object
+    opened in binary mode. Call `close` (which does not close `fd`) once
+    the battle is over.
+
+    Recording does not slow the battle down much: the memory and the
+    warriors append integers to a journal, on the fast path of the Mars,
+    and the Mars flushes it to `fd` every core.JOURNAL_SIZE entries."""
+    def __init__(self, mars, fd):
+        if mars._recorder is not None:
+            raise TraceError('The Mars is already recorded.')
+        self._mars = mars
+        self._memory = memory = mars.memory
+        self._fd = fd
+        warriors = list(mars.warriors)
+
+        fd.write(_header.pack(MAGIC, VERSION, memory.size, len(warriors)))
+        for warrior in warriors:
+            name = str(warrior).encode('utf8')
+            threads = list(warrior._threads)
+            fd.write(_warrior.pack(len(name), len(threads)) + name)
+            fd.write(b''.join([_ptr.pack(x) for x in threads]))
+        fd.write(b''.join([_pack_cell(memory.read(x).fields)
+                           for x in xrange(0, memory.size)]))
+
+        self._journal = memory._journal = []
+        mars._recorder = self
+
+    def flush(self):
+        """Writes the journal to the file."""
+        self._fd.write(_journal_bytes(self._journal))
+        del self._journal[:]
+
+    def close(self):
+        """Stops recording, and writes the pending records."""
+        self.flush()
+        self._mars._recorder = None
+        self._memory._journal = None
+
+
+class _Cells(object):
+    """Memory-like overlay on the cells of a Replay, on which operands can
+    be evaluated without changing them."""
+    def __init__(self, cells, size):
+        self._cells = cells
+        self._changed = {}
+        self.size = size
+
+    def read(self, ptr):
+        ptr %= self.size
+        inst = self._changed.get(ptr)
+        if inst is None:
+            inst = core.Instruction.from_fields(*self._cells[ptr])
+            self._changed[ptr] = inst
+        return inst
+
+    def set_a(self, ptr, value):
+        self.read(ptr)._A_value = core.fold(value, self.size)
+
+    def set_b(self, ptr, value):
+        self.read(ptr)._B_value = core.fold(value, self.size)
+
+
+Step = collections.namedtuple('Step',
+        'warrior pc opcode modifier reads changes threads')
+Step.__doc__ = """A step of a trace. `reads` is the list of the cells
+its operands read, `changes` a list of (ptr, old fields, new fields) and
+`threads` the list of the processes created."""
+
+class Replay(object):
+    """Rebuilds the state of the memory and of the process queues at any
+    step or cycle of a trace file, without running the battle. Call
+    `close` once done, or use it as a context manager."""
+    def __init__(self, path):
+        with open(path, 'rb') as fd:
+            data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load(path, data)
+        finally:
+            data.close()
+        self._position = 0
+
+    def _load(self, path, data):
+        (magic, version, size, warriors) = _header.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise TraceError('%s is not a trace file.' % path)
+        self._size = size
+        offset = _header.size
+        self.warriors = []
+        self._threads = []
+        for i in xrange(0, warriors):
+            (name_length, threads) = _warrior.unpack_from(data, offset)
+            offset += _warrior.size
+            self.warriors.append(bytes(data[offset:offset+name_length])
+                                 .decode('utf8'))
+            offset += name_length
+            self._threads.append(collections.deque([
+                _ptr.unpack_from(data, offset + i*_ptr.size)[0]
+                for i in xrange(0, threads)]))
+            offset += threads * _ptr.size
+        cells = [_cell.unpack_from(data, offset + i*_cell.size)
+                 for i in xrange(0, size)]
+        offset += size * _cell.size
+        self._memory = [_unpack_cell(_cell.pack(*x), 0) for x in cells]
+        journal = array.array('i')
+        journal.frombytes(data[offset:len(data) - (len(data) - offset) % 4])
+        if sys.byteorder != 'little':
+            journal.byteswap()
+
+        # Rebuilds the steps (warrior, pc, instruction, changes with the
+        # old and new content of the cells, processes created) by applying
+        # the journal to a copy of the memory and of the process queues.
+        # Warriors run in turn, as in Mars.run.
+        threads = [collections.deque(x) for x in self._threads]
+        turns = collections.deque([i for i in xrange(0, warriors)
+                                   if threads[i]])
+        records = []
+        self._steps = []
+        self._cycles = [0]
+        old = {} # Content of the cells changed by the step, before it
+        steps = 0
+        (i, length) = (0, len(journal))
+        while i < length:
+            entry = journal[i]
+            if entry == _END_OF_CYCLE:
+                self._cycles.append(steps)
+                i += 1
+                continue
+            elif entry < 0: # End of the step
+                created = -2 - entry
+                new_threads = journal[i+1:i+1+created]
+                i += 1 + created
+                if not turns or i > length:
+                    break # Truncated trace
+                warrior = turns.popleft()
+                pc = threads[warrior].popleft()
+                threads[warrior].extend(new_threads)
+                if threads[warrior]:
+                    turns.append(warrior)
+                (opcode, modifier, A_mode, B_mode) = \
+                        old.get(pc, cells[pc])[0:4]
+                changes = [_ptr.pack(ptr) + _cell.pack(*old[ptr]) +
+                           _cell.pack(*cells[ptr])
+                           for ptr in sorted(old) if old[ptr] != cells[ptr]]
+                self._steps.append(len(records))
+                records.append(_step.pack(warrior, pc,
+                    core._decode_ids(opcode, modifier, A_mode, B_mode),
+                    len(changes), created))
+                records.extend(changes)
+                records.append(struct.pack('<%iI' % created, *new_threads))
+                old = {}
+                steps += 1
+                continue
+            (type_, ptr) = divmod(entry, size)
+            cell = cells[ptr]
+            if ptr not in old:
+                old[ptr] = cell
+            if type_ == _SET_A:
+                cells[ptr] = cell[0:4] + (journal[i+1], cell[5])
+                i += 2
+            elif type_ == _SET_B:
+                cells[ptr] = cell[0:5] + (journal[i+1],)
+                i += 2
+            elif type_ == _COPY:
+                cells[ptr] = cells[journal[i+1]]
+                i += 2
+            else:
+                cells[ptr] = tuple(journal[i+1:i+7])
+                i += 7
+        # Offsets of the records of each step
+        self._data = b''.join(records)
+        offsets = [0]
+        for record in records:
+            offsets.append(offsets[-1] + len(record))
+        self._steps = [offsets[x] for x in self._steps]
+
+    def close(self):
+        """Releases the rebuilt steps."""
+        self._data = self._steps = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        """Number of steps of the trace."""
+        return len(self._steps)
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def position(self):
+        """Number of steps applied."""
+        return self._position
+
+    @property
+    def cycle(self):
+        """Number of cycles completed."""
+        return bisect.bisect_right(self._cycles, self._position) - 1
+
+    @property
+    def cycles(self):
+        """Number of cycles of the trace."""
+        return len(self._cycles) - 1
+
+    def read(self, ptr):
+        return core.Instruction.from_fields(*self._memory[ptr % self._size])
+
+    def threads(self, warrior):
+        """Process queue of the `warrior`-th warrior."""
+        return list(self._threads[warrior])
+
+    def get_step(self, index):
+        """Returns a step. Its `reads` are None: they are computed from the
+        state of the memory before the step, by `forward` and
+        `backward`."""
+        data = self._data
+        offset = self._steps[index]
+        (warrior, pc, id_, changes, threads) = _step.unpack_from(data, offset)
+        offset += _step.size
+        unpack = _ptr.unpack_from
+        changes_ = []
+        for i in xrange(0, changes):
+            changes_.append((unpack(data, offset)[0],
+                             _unpack_cell(data, offset + _ptr.size),
+                             _unpack_cell(data, offset + _ptr.size +
+                                          _cell.size)))
+            offset += _ptr.size + 2*_cell.size
+        threads_ = [unpack(data, offset + i*_ptr.size)[0]
+                    for i in xrange(0, threads)]
+        (opcode, modifier) = core._dispatch[id_][0:2]
+        return Step(warrior, pc, opcode, modifier, None, changes_, threads_)
+
+    def _reads(self, pc):
+        """Cells read by the operands of the instruction at `pc`, in the
+        current state."""
+        cells = _Cells(self._memory, self._size)
+        inst = cells.read(pc)
+        reads = set([pc])
+        for (mode, value) in ((inst.A_mode, inst.A_value),
+                              (inst.B_mode, inst.B_value)):
+            if mode != core.IMMEDIATE and mode != core.DIRECT:
+                reads.add((pc + value) % self._size)
+            reads.add(core._evaluate(cells, pc, mode, value) % self._size)
+            core._increment(cells, pc, mode, value)
+        return sorted(reads)
+
+    def forward(self):
+        """Applies the next step, and returns it."""
+        if self._position == len(self._steps):
+            raise TraceError('End of the trace.')
+        step = self.get_step(self._position)
+        step = step._replace(reads=self._reads(step.pc))
+        for (ptr, old, new) in step.changes:
+            self._memory[ptr] = new
+        threads = self._threads[step.warrior]
+        threads.popleft()
+        threads.extend(step.threads)
+        self._position += 1
+        return step
+
+    def backward(self):
+        """Reverts the previous step, and returns it."""
+        if self._position == 0:
+            raise TraceError('Beginning of the trace.')
+        self._position -= 1
+        step = self.get_step(self._position)
+        for (ptr, old, new) in step.changes:
+            self._memory[ptr] = old
+        step = step._replace(reads=self._reads(step.pc))
+        threads = self._threads[step.warrior]
+        for ptr in step.threads:
+            threads.pop()
+        threads.appendleft(step.pc)
+        return step
+
+    def seek(self, position):
+        """Goes to the state after `position` steps."""
+        if not 0 <= position <= len(self._steps):
+            raise TraceError('No step %i in the trace.' % position)
+        while self._position < position:
+            self.forward()
+        while self._position > position:
+            self.backward()
+
+    def seek_cycle(self, cycle):
+        """Goes to the state at the beginning of `cycle` (ie. after
+        `cycle` cycles)."""
+        if not 0 <= cycle < len(self._cycles):
+            raise TraceError('No cycle %i in the trace.' % cycle)
+        self.seek(self._cycles[cycle])
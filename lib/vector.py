@@ -0,0 +1,398 @@
+# Copyright (C) 2012, Valentin Lorentz
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Runs many battles between the same warriors in lockstep, with NumPy.
+
+Each field of the cores is stored as a (battles x coresize) array, and each
+step executes the current instruction of every battle at once, grouped by
+opcode. core.Mars is the reference implementation: both engines must give
+the same results."""
+
+from __future__ import print_function
+
+__all__ = ['VectorMars']
+
+import numpy
+
+try:
+    from . import core
+except (ImportError, ValueError): # Not imported from the vmars package
+    import core
+
+(IMMEDIATE, DIRECT, A_INDIRECT, A_PREDECREMENT, A_POSTINCREMENT,
+ B_PREDECREMENT, B_POSTINCREMENT) = (core.IMMEDIATE, core.DIRECT,
+        core.A_INDIRECT, core.A_PREDECREMENT, core.A_POSTINCREMENT,
+        core.B_PREDECREMENT, core.B_POSTINCREMENT)
+
+if 'xrange' not in globals(): # Python 3
+    xrange = range
+
+OPCODES = dict([(x, i) for (i, x) in enumerate(core.SYNTAX.opcodes)])
+MODIFIERS = dict([(x, i) for (i, x) in enumerate(core.SYNTAX.modifiers)])
+
+# Fields modifiers work on, as in core._modifier_fields: for each modifier,
+# up to two pairs of (field of the A instruction, field of the B
+# instruction). 0 is the A-field, 1 the B-field, and -1 means there is no
+# second pair.
+_pairs = {
+        'A': ((0, 0), (-1, -1)),
+        'B': ((1, 1), (-1, -1)),
+        'AB': ((0, 1), (-1, -1)),
+        'BA': ((1, 0), (-1, -1)),
+        'F': ((0, 0), (1, 1)),
+        'X': ((0, 1), (1, 0)),
+        'I': ((0, 0), (1, 1)),
+        }
+(SRC1, DST1, SRC2, DST2) = [numpy.array([_pairs[x][i // 2][i % 2]
+                                         for x in core.SYNTAX.modifiers])
+                            for i in xrange(0, 4)]
+# Fields LDP and STP work on, as in core._pspace_fields
+_fields = {'_A_value': 0, '_B_value': 1}
+(PSPACE_SRC, PSPACE_DST) = [numpy.array([_fields[core._pspace_fields[x][i]]
+                                         for x in core.SYNTAX.modifiers])
+                            for i in (0, 1)]
+
+class VectorMars(object):
+    def __init__(self, properties, battles):
+        if not isinstance(properties, core.MarsProperties):
+            raise ValueError('`properties` must be an instance of '
+                    'core.MarsProperties, not %r' % properties)
+        self._properties = properties
+        self._battles = battles
+        self._size = size = properties.coresize
+        shape = (battles, size)
+        self._opcodes = numpy.zeros(shape, numpy.int8) + OPCODES['DAT']
+        # Modifiers are stored resolved, as instructions never change
+        # their addressing modes in place.
+        self._modifiers = numpy.zeros(shape, numpy.int8) + MODIFIERS['F']
+        self._A_modes = numpy.zeros(shape, numpy.int8) + DIRECT
+        self._A_values = numpy.zeros(shape, numpy.int32)
+        self._B_modes = numpy.zeros(shape, numpy.int8) + DIRECT
+        self._B_values = numpy.zeros(shape, numpy.int32)
+        self._warriors = []
+        # Process queues, as ring buffers
+        self._queues = []
+        self._heads = []
+        self._counts = []
+        self._pspaces = []
+
+    @property
+    def properties(self):
+        return self._properties
+
+    @property
+    def warriors(self):
+        return self._warriors
+
+    def _columns(self):
+        return (self._opcodes, self._modifiers, self._A_modes,
+                self._A_values, self._B_modes, self._B_values)
+
+    def load(self, warrior, offsets):
+        """Loads the warrior in all the battles, at the given offsets (one
+        per battle)."""
+        if len(offsets) != self._battles:
+            raise ValueError('One offset per battle is needed.')
+        size = self._size
+        offsets = numpy.asarray(offsets, numpy.int64) % size
+        program = [inst.copy(size) for inst in warrior.program]
+        if program:
+            rows = numpy.arange(self._battles)[:, None]
+            cols = (offsets[:, None] + numpy.arange(len(program))) % size
+            fields = ([OPCODES[x.opcode] for x in program],
+                      [MODIFIERS[x.modifier] for x in program],
+                      [x.A_mode for x in program],
+                      [x.A_value for x in program],
+                      [x.B_mode for x in program],
+                      [x.B_value for x in program])
+            for (column, values) in zip(self._columns(), fields):
+                column[rows, cols] = values
+        maxprocesses = self._properties.maxprocesses
+        queue = numpy.zeros((self._battles, maxprocesses), numpy.int32)
+        queue[:, 0] = (offsets + warrior.origin) % size
+        self._queues.append(queue)
+        self._heads.append(numpy.zeros(self._battles, numpy.int64))
+        self._counts.append(numpy.ones(self._battles, numpy.int64))
+        # Each battle starts with the P-space the warrior has in core.Mars
+        pspace = warrior.pspace
+        if pspace is None or len(pspace) != self._properties.pspacesize:
+            pspace = core._new_pspace(self._properties.pspacesize, size)
+        self._pspaces.append(numpy.tile(numpy.array(pspace, numpy.int64),
+                                        (self._battles, 1)))
+        self._warriors.append(warrior)
+
+    def read(self, battle, ptr):
+        """Returns the instruction at `ptr` in a battle."""
+        ptr %= self._size
+        return core.Instruction.from_fields(
+                core.SYNTAX.opcodes[self._opcodes[battle, ptr]],
+                core.SYNTAX.modifiers[self._modifiers[battle, ptr]],
+                int(self._A_modes[battle, ptr]),
+                int(self._A_values[battle, ptr]),
+                int(self._B_modes[battle, ptr]),
+                int(self._B_values[battle, ptr]))
+
+    def threads(self, battle, warrior):
+        """Returns the process queue of a warrior in a battle."""
+        queue = self._queues[warrior][battle]
+        (head, count) = (self._heads[warrior][battle],
+                         self._counts[warrior][battle])
+        return [int(queue[(head + i) % len(queue)]) for i in xrange(count)]
+
+    def pspace(self, battle, warrior):
+        """Returns the P-space of a warrior in a battle."""
+        return [int(x) for x in self._pspaces[warrior][battle]]
+
+    def run_battles(self, max_cycles=None):
+        """Runs all the battles, with the same rules as Mars.run_battle,
+        and returns the list of their core.BattleResult."""
+        if max_cycles is None:
+            max_cycles = self._properties.maxcycles
+        counts = self._counts
+        deaths = numpy.zeros((self._battles, len(self._warriors)),
+                numpy.int64)
+        cycles = numpy.zeros(self._battles, numpy.int64)
+        left = 1 if len(self._warriors) > 1 else 0
+
+        def alive():
+            return sum([(x > 0).astype(numpy.int64) for x in counts])
+        finished = alive() <= left
+        for cycle in xrange(1, max_cycles + 1):
+            running = ~finished
+            if not running.any():
+                break
+            for (i, count) in enumerate(counts):
+                battles = numpy.nonzero(running & (count > 0))[0]
+                if len(battles):
+                    self._step(i, battles)
+                    died = battles[count[battles] == 0]
+                    deaths[died, i] = cycle
+            cycles[running] = cycle
+            finished |= alive() <= left
+
+        results = []
+        for battle in xrange(0, self._battles):
+            results.append(core.BattleResult(list(self._warriors),
+                int(cycles[battle]),
+                [x for (i, x) in enumerate(self._warriors)
+                    if deaths[battle, i] == 0],
+                [int(x) or None for x in deaths[battle]],
+                [int(x[battle]) for x in counts]))
+        return results
+
+    def _fold(self, values):
+        """Vectorized core.fold."""
+        size = self._size
+        values = values % size
+        return numpy.where(values > size // 2, values - size, values)
+
+    def _get(self, battles, ptr, field):
+        """Values of the A (field is 0) or B (field is 1) field of the
+        instructions at `ptr`."""
+        return numpy.where(field == 0,
+                self._A_values[battles, ptr], self._B_values[battles, ptr]
+                ).astype(numpy.int64)
+
+    def _set(self, battles, ptr, field, values):
+        """Writes the values to the A or B field of the instructions at
+        `ptr`."""
+        values = self._fold(values)
+        mask = field == 0
+        self._A_values[battles[mask], ptr[mask]] = values[mask]
+        mask = field == 1
+        self._B_values[battles[mask], ptr[mask]] = values[mask]
+
+    def _copied(self, register, field):
+        """Values of the A (field is 0) or B (field is 1) field of the
+        copied instructions of a register (the columns of IRA or IRB)."""
+        return numpy.where(field == 0, register[3], register[5]
+                ).astype(numpy.int64)
+
+    def _evaluate(self, battles, pc, mode, value):
+        """Vectorized core._evaluate."""
+        size = self._size
+        ptr = (pc + value) % size
+        for (predecrement, column) in ((A_PREDECREMENT, self._A_values),
+                                       (B_PREDECREMENT, self._B_values)):
+            mask = mode == predecrement
+            (b, p) = (battles[mask], ptr[mask])
+            column[b, p] = self._fold(column[b, p].astype(numpy.int64)-1)
+        A = self._A_values[battles, ptr].astype(numpy.int64)
+        B = self._B_values[battles, ptr].astype(numpy.int64)
+        uses_A = (mode == A_INDIRECT) | (mode == A_PREDECREMENT) | \
+                (mode == A_POSTINCREMENT)
+        return numpy.select([mode == IMMEDIATE, mode == DIRECT, uses_A],
+                            [pc, ptr, ptr + A], ptr + B) % size
+
+    def _increment(self, battles, pc, mode, value):
+        """Vectorized core._increment."""
+        ptr = (pc + value) % self._size
+        for (postincrement, column) in ((A_POSTINCREMENT, self._A_values),
+                                        (B_POSTINCREMENT, self._B_values)):
+            mask = mode == postincrement
+            (b, p) = (battles[mask], ptr[mask])
+            column[b, p] = self._fold(column[b, p].astype(numpy.int64)+1)
+
+    def _step(self, warrior, battles):
+        """Runs the next process of the warrior in the given battles."""
+        size = self._size
+        (queue, heads, counts) = (self._queues[warrior],
+                self._heads[warrior], self._counts[warrior])
+        maxprocesses = queue.shape[1]
+        pc = queue[battles, heads[battles]].astype(numpy.int64)
+        heads[battles] = (heads[battles] + 1) % maxprocesses
+        counts[battles] -= 1
+
+        # Operands evaluation, as in Instruction.run: the fields of the
+        # instruction are read first, and each register is copied before
+        # the postincrement of its operand.
+        A_mode = self._A_modes[battles, pc]
+        B_mode = self._B_modes[battles, pc]
+        A_value = self._A_values[battles, pc].astype(numpy.int64)
+        B_value = self._B_values[battles, pc].astype(numpy.int64)
+        A_ptr = self._evaluate(battles, pc, A_mode, A_value)
+        A = [column[battles, A_ptr] for column in self._columns()]
+        self._increment(battles, pc, A_mode, A_value)
+        B_ptr = self._evaluate(battles, pc, B_mode, B_value)
+        B = [column[battles, B_ptr] for column in self._columns()]
+        self._increment(battles, pc, B_mode, B_value)
+
+        # Execution, grouped by opcode
+        opcodes = self._opcodes[battles, pc]
+        modifiers = self._modifiers[battles, pc]
+        new1 = numpy.zeros(len(battles), numpy.int64) - 1
+        new2 = numpy.zeros(len(battles), numpy.int64) - 1
+        for opcode in numpy.unique(opcodes):
+            name = core.SYNTAX.opcodes[opcode]
+            mask = opcodes == opcode
+            (b, m) = (battles[mask], modifiers[mask])
+            args = (b, pc[mask], A_ptr[mask], B_ptr[mask],
+                    [x[mask] for x in A], [x[mask] for x in B],
+                    SRC1[m], DST1[m], SRC2[m], DST2[m], m, warrior)
+            (new1[mask], new2[mask]) = self._execute(name, *args)
+
+        # Queue the new processes
+        for new in (new1, new2):
+            mask = (new >= 0) & (counts[battles] < maxprocesses)
+            b = battles[mask]
+            queue[b, (heads[b] + counts[b]) % maxprocesses] = new[mask] % size
+            counts[b] += 1
+
+    def _execute(self, name, b, pc, A_ptr, B_ptr, A, B,
+            src1, dst1, src2, dst2, modifiers, warrior):
+        """Runs instructions with the same opcode, and returns the arrays
+        of the first and second new processes (-1 if there is none). `A`
+        and `B` are the copies of the columns of the A and B instructions
+        (IRA and IRB)."""
+        size = self._size
+        none = numpy.zeros(len(b), numpy.int64) - 1
+        has2 = src2 >= 0
+        next_ = pc + 1
+        if name == 'DAT':
+            return (none, none)
+        elif name == 'NOP':
+            return (next_, none)
+        elif name == 'JMP':
+            return (A_ptr, none)
+        elif name == 'SPL':
+            return (next_, A_ptr)
+        elif name == 'MOV':
+            is_i = modifiers == MODIFIERS['I']
+            for (column, value) in zip(self._columns(), A):
+                column[b[is_i], B_ptr[is_i]] = value[is_i]
+            a1 = self._copied(A, src1)
+            a2 = self._copied(A, src2)
+            (b, B_ptr, dst1, dst2) = (b[~is_i], B_ptr[~is_i], dst1[~is_i],
+                    numpy.where(has2, dst2, -1)[~is_i])
+            self._set(b, B_ptr, dst1, a1[~is_i])
+            self._set(b, B_ptr, dst2, a2[~is_i])
+            return (next_, none)
+        elif name in ('ADD', 'SUB', 'MUL', 'DIV', 'MOD'):
+            alive = numpy.ones(len(b), bool)
+            results = []
+            for (src, dst, enabled) in ((src1, dst1, True), (src2, dst2, has2)):
+                a = self._copied(A, src) % size
+                v = self._copied(B, dst) % size
+                if name == 'ADD':
+                    r = v + a
+                elif name == 'SUB':
+                    r = v - a
+                elif name == 'MUL':
+                    r = v * a
+                else:
+                    zero = enabled & (a == 0)
+                    alive &= ~zero
+                    enabled = enabled & ~zero
+                    a = numpy.where(a == 0, 1, a)
+                    r = v // a if name == 'DIV' else v % a
+                results.append((numpy.where(enabled, dst, -1), r))
+            # Both fields are computed before being written
+            for (dst, r) in results:
+                self._set(b, B_ptr, dst, r)
+            return (numpy.where(alive, next_, -1), none)
+        elif name in ('JMZ', 'JMN'):
+            v1 = self._copied(B, dst1)
+            v2 = numpy.where(has2, self._copied(B, dst2), 0)
+            nonzero = (v1 != 0) | (v2 != 0)
+            if name == 'JMZ':
+                return (numpy.where(nonzero, next_, A_ptr), none)
+            else:
+                return (numpy.where(nonzero, A_ptr, next_), none)
+        elif name == 'DJN':
+            # The cells are decremented, and the jump depends on the
+            # decremented B register.
+            self._set(b, B_ptr, dst1, self._get(b, B_ptr, dst1) - 1)
+            mask = has2
+            self._set(b[mask], B_ptr[mask], dst2[mask],
+                    self._get(b[mask], B_ptr[mask], dst2[mask]) - 1)
+            v1 = (self._copied(B, dst1) - 1) % size
+            v2 = numpy.where(has2, (self._copied(B, dst2) - 1) % size, 0)
+            nonzero = (v1 != 0) | (v2 != 0)
+            return (numpy.where(nonzero, A_ptr, next_), none)
+        elif name in ('CMP', 'SEQ', 'SNE', 'SLT'):
+            a1 = self._copied(A, src1)
+            v1 = self._copied(B, dst1)
+            a2 = self._copied(A, src2)
+            v2 = self._copied(B, dst2)
+            if name == 'SLT':
+                true = (a1 % size < v1 % size) & \
+                        (~has2 | (a2 % size < v2 % size))
+            else:
+                true = (a1 == v1) & (~has2 | (a2 == v2))
+                is_i = modifiers == MODIFIERS['I']
+                equal = numpy.ones(len(b), bool)
+                for (a, v) in zip(A, B):
+                    equal &= a == v
+                true = numpy.where(is_i, equal, true)
+                if name == 'SNE':
+                    true = ~true
+            return (numpy.where(true, pc + 2, next_), none)
+        elif name in ('LDP', 'STP'):
+            pspace = self._pspaces[warrior]
+            (src, dst) = (PSPACE_SRC[modifiers], PSPACE_DST[modifiers])
+            if name == 'LDP':
+                index = self._copied(A, src) % pspace.shape[1]
+                self._set(b, B_ptr, dst, pspace[b, index])
+            else:
+                index = self._copied(B, dst) % pspace.shape[1]
+                pspace[b, index] = self._copied(A, src) % size
+            return (next_, none)
+        else:
+            raise NotImplementedError()
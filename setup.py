@@ -18,5 +18,7 @@ setup(
     package_dir = {'vmars': 'lib'},
     scripts=['bin/vcore',
             'bin/vasm',
+            'bin/vtourney',
+            'bin/vreplay',
             ]
     )
@@ -1,4 +1,7 @@
 
+import io
+import shutil
+import tempfile
 import unittest
 
 import core
@@ -24,6 +27,102 @@ class TestAssembler(unittest.TestCase):
                           'DAT #0, #0'
                          ]
                         )
+    def testCache(self):
+        cache = assembler.AssemblyCache(maxsize=2)
+        assembler_ = assembler.Assembler(core.MarsProperties(), cache)
+        load = assembler_.assemble('imp MOV imp, imp+1')
+        self.assertEqual(load, (0, ['MOV 0, 1']))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(assembler_.assemble('imp MOV imp, imp+1'), load)
+        self.assertEqual(assembler_.assemble('imp MOV imp, imp+1', raw=True),
+                (0, 'ORG 0\nMOV.I $0, $1\n'))
+        self.assertEqual(len(cache), 1)
+
+        # Cached instructions are not shared
+        load[1][0].A = '$5'
+        self.assertEqual(assembler_.assemble('imp MOV imp, imp+1')[1],
+                ['MOV 0, 1'])
+
+        # Properties are part of the key
+        assembler2 = assembler.Assembler(
+                core.MarsProperties(coresize=200), cache)
+        self.assertEqual(assembler2.assemble('MOV 0, coresize')[1],
+                ['MOV 0, 200'])
+        self.assertEqual(self.assemble('MOV 0, coresize')[1],
+                ['MOV 0, 8000'])
+        self.assertEqual(len(cache), 2)
+
+    def testDiskCache(self):
+        path = tempfile.mkdtemp()
+        try:
+            assembler_ = assembler.Assembler(core.MarsProperties(),
+                    assembler.AssemblyCache(directory=path))
+            load = assembler_.assemble('imp MOV imp, imp+1')
+            cache = assembler.AssemblyCache(directory=path)
+            key = cache.key('imp MOV imp, imp+1', core.MarsProperties())
+            self.assertEqual(cache.get(key), load)
+        finally:
+            shutil.rmtree(path)
+
+    def testBinaryLoadFile(self):
+        lines = [';redcode-94\n', ';name Dwarf\n', ';author A. K. Dewdney\n',
+                 'loop ADD.AB #4, bomb\n', '     MOV.I bomb, @bomb\n',
+                 '     JMP loop\n', 'bomb DAT #0, #0\n']
+        self.assertEqual(assembler.read_header(lines),
+                ('Dwarf', 'A. K. Dewdney'))
+        streamed = io.BytesIO()
+        self._assembler.dump_load_file(streamed, iter(lines))
+        assembler_ = assembler.Assembler(core.MarsProperties(),
+                assembler.AssemblyCache())
+        for i in range(0, 2): # Not cached yet, then cached
+            cached = io.BytesIO()
+            assembler_.dump_load_file(cached, iter(lines))
+            self.assertEqual(cached.getvalue(), streamed.getvalue())
+        warrior = core.Warrior.from_binary(streamed.getvalue())
+        self.assertEqual((warrior.name, warrior.author),
+                ('Dwarf', 'A. K. Dewdney'))
+
+    def testExpressions(self):
+        self.assertEqual(self.assemble('MOV #2*(3+4), -7/2')[1],
+                ['MOV #14, -3'])
+        self.assertEqual(self.assemble('MOV #-7%3, CORESIZE-1')[1],
+                ['MOV #-1, 7999'])
+        self.assertEqual(self.assemble('''
+                                          step EQU 4
+                                          gap  EQU step*2
+                                               ADD #gap+1, step
+                                       ''')[1],
+                         ['ADD #9, 4'])
+        self.assertEqual(self.assemble('''
+                                               ORG start
+                                               DAT 0, 0
+                                          start JMP start
+                                       '''),
+                         (1, ['DAT 0, 0', 'JMP 0']))
+        self.assertRaises(assembler.ParseError, self.assemble, 'MOV 0, 1/0')
+        self.assertRaises(assembler.ParseError, self.assemble, 'MOV 0, foo')
+        self.assertRaises(assembler.ParseError, self.assemble, 'MOV 0, (1')
+        self.assertRaises(assembler.ParseError, self.assemble,
+                'MOV 0, __import__(1)')
+        self.assertRaises(assembler.ParseError, self.assemble,
+                'MOV 0, x.y')
+
+    def testStream(self):
+        source = ['JMP end\n',
+                  'start MOV 0, 1\n',
+                  'end JMP start\n',
+                  'END start\n']
+        stream = self._assembler.assemble_stream(iter(source))
+        self.assertEqual(stream.origin, None)
+        self.assertEqual(next(stream), 'JMP 2')
+        self.assertEqual(list(stream), ['MOV 0, 1', 'JMP -1'])
+        self.assertEqual(stream.origin, 1)
+        self.assertEqual(list(self._assembler.assemble_stream(source, True)),
+                ['JMP.B $2, $0\n', 'MOV.I $0, $1\n', 'JMP.B $-1, $0\n',
+                 'ORG 1\n'])
+        self.assertRaises(assembler.ParseError, list,
+                self._assembler.assemble_stream(['JMP foo']))
+
     def testParse(self):
         self.assertRaises(assembler.ParseError, self.assemble, 'ABC')
         self.assertRaises(assembler.ParseError, self.assemble, 'ABC 5')
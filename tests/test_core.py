@@ -1,3 +1,10 @@
+import io
+import os
+import json
+import random
+import shutil
+import tempfile
+import itertools
 import unittest
 
 import vmars.core as core
@@ -11,9 +18,10 @@ dwarf = '''
         '''
 
 class VMarsTestCase(unittest.TestCase):
+    memory_class = core.Memory
     def setUp(self):
         self._properties = core.MarsProperties(coresize=200)
-        self._mars = core.Mars(self._properties)
+        self._mars = core.Mars(self._properties, self.memory_class)
         self._memory = self._mars.memory
 
 class TestInstruction(VMarsTestCase):
@@ -39,14 +47,48 @@ class TestInstruction(VMarsTestCase):
         self.assertIsNot(core.Instruction('DAT', None, '0', '0'),
                 core.Instruction('DAT', None, '0', '0'))
 
+    def testFields(self):
+        inst = core.Instruction.from_string('MOV.X $52, @-621')
+        self.assertEqual(inst.A_mode, core.DIRECT)
+        self.assertEqual(inst.A_value, 52)
+        self.assertEqual(inst.B_mode, core.B_INDIRECT)
+        self.assertEqual(inst.B_value, -621)
+        self.assertEqual(inst, core.Instruction.from_fields('MOV', 'X',
+            core.DIRECT, 52, core.B_INDIRECT, -621))
+
+        inst.A = '{3'
+        self.assertEqual(inst.A_mode, core.A_PREDECREMENT)
+        self.assertEqual(inst.A_value, 3)
+
+        # Values are reduced modulo the core size when loaded
+        self._memory.load(10, core.Warrior('DAT #399, #-101'))
+        self.assertEqual(self._memory.read(10).A_value, -1)
+        self.assertEqual(self._memory.read(10).B_value, 99)
+
+    def testModifier(self):
+        inst = core.Instruction.from_string('MOV 1, 2')
+        self.assertEqual(inst.modifier, 'I')
+        inst.A = '#1'
+        self.assertEqual(inst.modifier, 'AB')
+        inst.opcode = 'ADD'
+        self.assertEqual(inst.modifier, 'AB')
+        inst.A = '1'
+        self.assertEqual(inst.modifier, 'F')
+        inst.modifier = 'X'
+        self.assertEqual(inst.modifier, 'X')
+        self.assertEqual(core.Instruction.from_string('SLT #1, 2').modifier,
+                'AB')
+
     def testPredecrement(self):
         warrior = core.Warrior('''MOV 1, {1
                                   DAT 3, 0''')
         self._memory.load(10, warrior)
         warrior.run(self._memory)
+        # The target is relative to the decremented cell, and the A
+        # instruction is read before the decrement.
         self.assertEqual(self._memory.read(11), 'DAT 2, 0')
-        self.assertEqual(self._memory.read(12), 'DAT 2, 0')
-        self.assertEqual(self._memory.read(13), 'DAT 0, 0')
+        self.assertEqual(self._memory.read(12), 'DAT 0, 0')
+        self.assertEqual(self._memory.read(13), 'DAT 3, 0')
 
     def testPostincrement(self):
         warrior = core.Warrior('''MOV 1, }1
@@ -54,9 +96,30 @@ class TestInstruction(VMarsTestCase):
         self._memory.load(10, warrior)
         warrior.run(self._memory)
         self.assertEqual(self._memory.read(11), 'DAT 3, 0')
-        self.assertEqual(self._memory.read(13), 'DAT 0, 0')
-        self.assertEqual(self._memory.read(12), 'DAT 3, 0')
+        self.assertEqual(self._memory.read(12), 'DAT 0, 0')
+        self.assertEqual(self._memory.read(13), 'DAT 2, 0')
+
+        # The B operand is read and written at the same place
+        warrior = core.Warrior('''ADD.AB #1, >1
+                                  DAT 0, 3''')
+        self._memory.load(20, warrior)
+        warrior.run(self._memory)
+        self.assertEqual(self._memory.read(21), 'DAT 0, 4')
+        self.assertEqual(self._memory.read(24), 'DAT 0, 1')
 
+    def testAddressingModeChange(self):
+        self._memory.write(10, core.Instruction.from_string('MOV 1, 2'))
+        self._memory.write(11, core.Instruction.from_string('DAT 0, 3'))
+        self._memory.read(10).run(self._memory, 10)
+        self.assertEqual(self._memory.read(12), 'DAT 0, 3')
+
+        # Changing a mode in place must not keep resolving it directly
+        self._memory.read(10).B_mode = core.B_INDIRECT
+        self._memory.read(10).run(self._memory, 10)
+        self.assertEqual(self._memory.read(15), 'DAT 0, 3')
+        self._memory.read(10).A_mode = core.IMMEDIATE
+        self._memory.read(10).run(self._memory, 10)
+        self.assertEqual(self._memory.read(15).B_value, 1)
 
 
     def testMov(self):
@@ -230,6 +293,178 @@ class TestInstruction(VMarsTestCase):
 
 
 
+class TestConformance(VMarsTestCase):
+    """Runs every opcode with every modifier and every pair of addressing
+    modes on random cells, and checks the result against a plain
+    transcription of the ICWS'94 reference interpreter (section 5.3),
+    working on lists of fields."""
+    (OPCODE, MODIFIER, A_MODE, A_VALUE, B_MODE, B_VALUE) = range(0, 6)
+    # (field of the A instruction, field of the B instruction)
+    fields = {'A': [(A_VALUE, A_VALUE)], 'B': [(B_VALUE, B_VALUE)],
+              'AB': [(A_VALUE, B_VALUE)], 'BA': [(B_VALUE, A_VALUE)],
+              'F': [(A_VALUE, A_VALUE), (B_VALUE, B_VALUE)],
+              'X': [(A_VALUE, B_VALUE), (B_VALUE, A_VALUE)],
+              'I': [(A_VALUE, A_VALUE), (B_VALUE, B_VALUE)]}
+    math = {'ADD': lambda a, b: b + a, 'SUB': lambda a, b: b - a,
+            'MUL': lambda a, b: b * a, 'DIV': lambda a, b: b // a,
+            'MOD': lambda a, b: b % a}
+
+    def operand(self, cells, pc, mode, value):
+        """Returns the pointer an operand resolves to, relative to pc, and
+        the (cell, field) to postincrement once the register is copied
+        (None if there is no postincrement)."""
+        size = self._memory.size
+        if mode == core.IMMEDIATE:
+            return (0, None)
+        if mode == core.DIRECT:
+            return (value, None)
+        cell = cells[(pc + value) % size]
+        field = self.A_VALUE if mode in (core.A_INDIRECT,
+                core.A_PREDECREMENT, core.A_POSTINCREMENT) else self.B_VALUE
+        if mode in (core.A_PREDECREMENT, core.B_PREDECREMENT):
+            cell[field] = core.fold(cell[field] - 1, size)
+        if mode in (core.A_POSTINCREMENT, core.B_POSTINCREMENT):
+            return (value + cell[field], (cell, field))
+        return (value + cell[field], None)
+
+    def increment(self, postincrement):
+        if postincrement is not None:
+            (cell, field) = postincrement
+            cell[field] = core.fold(cell[field] + 1, self._memory.size)
+
+    def expected(self, cells, pc, pspace):
+        """Runs the instruction at `pc`, changing `cells` (a list of lists
+        of fields) and `pspace`, and returns the new processes."""
+        size = self._memory.size
+        IR = list(cells[pc])
+        (opcode, modifier) = IR[0:2]
+        (RPA, PIP) = self.operand(cells, pc,
+                IR[self.A_MODE], IR[self.A_VALUE])
+        IRA = list(cells[(pc + RPA) % size])
+        self.increment(PIP)
+        (RPB, PIP) = self.operand(cells, pc,
+                IR[self.B_MODE], IR[self.B_VALUE])
+        IRB = list(cells[(pc + RPB) % size])
+        self.increment(PIP)
+        B = cells[(pc + RPB) % size]
+        fields = self.fields[modifier]
+        (next_, jump, skip) = [x % size for x in (pc + 1, pc + RPA, pc + 2)]
+        def put(field, value):
+            B[field] = core.fold(value, size)
+
+        if opcode == 'DAT':
+            return []
+        elif opcode == 'MOV' and modifier == 'I':
+            B[:] = IRA
+        elif opcode == 'MOV':
+            for (a, b) in fields:
+                put(b, IRA[a])
+        elif opcode in self.math:
+            alive = True
+            for (a, b) in fields:
+                if opcode in ('DIV', 'MOD') and IRA[a] % size == 0:
+                    alive = False
+                else:
+                    put(b, self.math[opcode](IRA[a] % size, IRB[b] % size))
+            if not alive:
+                return []
+        elif opcode == 'JMP':
+            return [jump]
+        elif opcode == 'JMZ':
+            zero = all([IRB[b] == 0 for (a, b) in fields])
+            return [jump if zero else next_]
+        elif opcode == 'JMN':
+            zero = all([IRB[b] == 0 for (a, b) in fields])
+            return [next_ if zero else jump]
+        elif opcode == 'DJN':
+            for (a, b) in fields:
+                put(b, B[b] - 1)
+            one = all([IRB[b] % size == 1 for (a, b) in fields])
+            return [next_ if one else jump]
+        elif opcode in ('CMP', 'SEQ', 'SNE'):
+            if modifier == 'I':
+                equal = IRA == IRB
+            else:
+                equal = all([IRA[a] == IRB[b] for (a, b) in fields])
+            return [skip if equal == (opcode != 'SNE') else next_]
+        elif opcode == 'SLT':
+            less = all([IRA[a] % size < IRB[b] % size for (a, b) in fields])
+            return [skip if less else next_]
+        elif opcode in ('LDP', 'STP'):
+            # F, X and I behave as B
+            (a, b) = fields[0] if modifier in ('A', 'B', 'AB', 'BA') \
+                    else self.fields['B'][0]
+            if opcode == 'LDP':
+                put(b, pspace[IRA[a] % len(pspace)])
+            else:
+                pspace[IRB[b] % len(pspace)] = IRA[a] % size
+        elif opcode == 'SPL':
+            return [next_, jump]
+        return [next_]
+
+    def testMatrix(self):
+        rand = random.Random(42)
+        memory = self._memory
+        size = memory.size
+        modes = range(0, len(core.SYNTAX.addressing))
+        def random_fields():
+            return [rand.choice(core.SYNTAX.opcodes),
+                    rand.choice(core.SYNTAX.modifiers),
+                    rand.choice(modes), rand.randint(-3, 3),
+                    rand.choice(modes), rand.randint(-3, 3)]
+        def read(ptr):
+            inst = memory.read(ptr)
+            return [inst.opcode, inst.modifier, inst.A_mode, inst.A_value,
+                    inst.B_mode, inst.B_value]
+        for (opcode, modifier, A_mode, B_mode) in itertools.product(
+                core.SYNTAX.opcodes, core.SYNTAX.modifiers, modes, modes):
+            # Cells around the instruction, from a small pool so that
+            # some of them are equal.
+            pool = [random_fields() for i in range(0, 3)]
+            cells = [['DAT', 'F', core.DIRECT, 0, core.DIRECT, 0]
+                     for i in range(0, size)]
+            for ptr in range(0, 20):
+                cells[ptr] = list(rand.choice(pool))
+            cells[10] = [opcode, modifier, A_mode, rand.randint(-3, 3),
+                         B_mode, rand.randint(-3, 3)]
+
+            warrior = core.Warrior('DAT 0, 0')
+            warrior._pspace = core._new_pspace(8, size)
+            for i in range(0, 8):
+                warrior._pspace[i] = rand.randrange(0, size)
+            memory.load(10, warrior)
+            for ptr in range(0, 20):
+                memory.write(ptr, core.Instruction.from_fields(*cells[ptr]))
+            case = '%s at 10 with %r' % (memory.read(10),
+                                         [str(memory.read(x))
+                                          for x in range(0, 20)])
+
+            pspace = list(warrior.pspace)
+            threads = self.expected(cells, 10, pspace)
+            warrior.run(memory)
+            self.assertEqual(warrior.threads, threads, case)
+            self.assertEqual([read(x) for x in range(0, size)], cells, case)
+            self.assertEqual(list(warrior.pspace), pspace, case)
+
+    def testPostincrementRegisters(self):
+        """The registers are copied before the postincrements, which
+        silk-style papers rely on."""
+        warrior = core.Warrior('DAT 0, 0')
+        self._memory.load(11, warrior)
+        self._memory.write(10, core.Instruction('SPL', 'B', '@0', '>50'))
+        self._memory.write(11, core.Instruction('MOV', 'I', '}-1', '>-1'))
+        warrior.run(self._memory)
+        self.assertEqual(self._memory.read(60), 'SPL.B @0, >50')
+        self.assertEqual(self._memory.read(10), 'SPL.B @1, >51')
+
+        # Postincrement of the B operand's own cell
+        self._memory.write(20, core.Instruction('ADD', 'AB', '#1', '>0'))
+        self._memory.read(20).run(self._memory, 20)
+        self.assertEqual(self._memory.read(20), 'ADD.AB #1, >1')
+        self._memory.write(30, core.Instruction('DJN', 'B', '$5', '>0'))
+        self.assertEqual(self._memory.read(30).run(self._memory, 30), [35])
+        self.assertEqual(self._memory.read(30), 'DJN.B $5, >0')
+
 class TestMemory(VMarsTestCase):
     def testSize(self):
         self.assertEqual(self._memory.size, 200)
@@ -258,6 +493,58 @@ class TestMemory(VMarsTestCase):
             self.assertEqual(self._memory.read(ptr), inst)
             ptr += 1
 
+    def testInPlace(self):
+        changes = []
+        self._memory.add_callback(lambda ptr, old, new:
+                changes.append((ptr, str(old), str(new))))
+        self._memory.write(5, core.Instruction.from_string('MOV <1, }2'))
+        cell = self._memory.read(7)
+        self._memory.set_a(7, 203)
+        self._memory.set_b(207, -1)
+        self._memory.copy_cell(5, 7)
+        self.assertEqual(self._memory.read(7), 'MOV <1, }2')
+        self._memory.set_b(7, 3)
+        self.assertEqual(self._memory.read(5), 'MOV <1, }2')
+        self.assertEqual(cell, 'MOV <1, }3')
+        self.assertEqual(changes[1:], [
+            (7, 'DAT.F $0, $0', 'DAT.F $3, $0'),
+            (7, 'DAT.F $3, $0', 'DAT.F $3, $-1'),
+            (7, 'DAT.F $3, $-1', 'MOV.I <1, }2'),
+            (7, 'MOV.I <1, }2', 'MOV.I <1, }3')])
+
+    def testWriteCopies(self):
+        inst = core.Instruction.from_string('DAT #1, #2')
+        self._memory.write(10, inst)
+        self._memory.write(20, inst)
+        for fast in (False, True):
+            warrior = core.Warrior('MOV.AB #7, 10')
+            self._memory.load(0, warrior)
+            if fast:
+                with self._memory.fast_path():
+                    self._memory.write(10, inst)
+                    warrior.run(self._memory)
+            else:
+                warrior.run(self._memory)
+            self.assertEqual(self._memory.read(10), 'DAT #1, #7')
+            self.assertEqual(self._memory.read(20), 'DAT #1, #2')
+            self.assertEqual(inst, 'DAT #1, #2')
+
+    def testNestedFastPath(self):
+        inst = core.Instruction.from_string('DAT #1, #2')
+        with self._memory.fast_path():
+            with self._memory.fast_path():
+                self._memory.write(10, inst)
+            self._memory.set_b(10, 3)
+        self.assertEqual(self._memory.read(10), 'DAT #1, #3')
+        self.assertRaises(ValueError, self._memory.read, 'foo')
+
+        # Callbacks are still called
+        changes = []
+        self._memory.add_callback(lambda *args: changes.append(args[0]))
+        with self._memory.fast_path():
+            self._memory.write(20, inst)
+        self.assertEqual(changes, [20])
+
     def testCallback(self):
         global cb_data
         cb_data = None
@@ -317,6 +604,17 @@ class TestWarrior(VMarsTestCase):
         self.assertEqual(warrior.threads, [ptr])
         self.assertEqual(self._memory.read(ptr+3+8), dat4)
 
+    def testMaxProcesses(self):
+        properties = core.MarsProperties(coresize=200, maxprocesses=5)
+        mars = core.Mars(properties)
+        warrior = core.Warrior('''SPL 0
+                                  MOV 0, 1''')
+        mars.load(warrior)
+        for i in range(0, 20):
+            mars.cycle()
+            self.assertTrue(len(warrior.threads) <= 5)
+        self.assertEqual(len(warrior.threads), 5)
+
     def testOrigin(self):
         warrior = core.Warrior('''ORG 2
                                   DAT 0, 0
@@ -324,6 +622,300 @@ class TestWarrior(VMarsTestCase):
         self._memory.load(10, warrior)
         self.assertEqual(warrior.threads, [12])
 
+    def testBinary(self):
+        fd = io.BytesIO()
+        core.dump_load_file(fd, core.Warrior(dwarf).program, 1,
+                name='dwarf', author='A. K. Dewdney')
+        data = fd.getvalue()
+        warrior = core.Warrior.from_binary(data)
+        self.assertEqual((warrior.name, warrior.author, warrior.origin),
+                ('dwarf', 'A. K. Dewdney', 1))
+        self._memory.load(150, warrior)
+        self.assertEqual(warrior.threads, [151])
+        self.assertEqual(self._memory.read(150), 'ADD.AB #4, $3')
+        self.assertEqual(self._memory.read(152), 'JMP -2')
+        self.assertEqual(warrior, core.Warrior(dwarf))
+        self.assertRaises(ValueError, core.Warrior.from_binary, b'x' * 16)
+
+        path = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(path, 'dwarf.rcb'), 'wb') as fd:
+                fd.write(data)
+            with open(os.path.join(path, 'dwarf.rc'), 'w') as fd:
+                fd.write(dwarf)
+            warrior = core.Warrior.from_file(os.path.join(path, 'dwarf.rcb'))
+            # The mapping of the file is closed once the warrior is built
+            self.assertEqual(type(warrior._packed[0]), bytes)
+            self._memory.load(50, warrior)
+            self.assertEqual(self._memory.read(52), 'JMP -2')
+            self.assertEqual(warrior,
+                    core.Warrior.from_file(os.path.join(path, 'dwarf.rc')))
+        finally:
+            shutil.rmtree(path)
+
+
+class TestMars(VMarsTestCase):
+    def testRunBattle(self):
+        imp_ = core.Warrior(imp)
+        dat = core.Warrior('DAT 0, 0')
+        self._mars.load(imp_)
+        self._mars.load(dat, 100)
+        result = self._mars.run_battle()
+        self.assertEqual(result.warriors, [imp_, dat])
+        self.assertEqual(result.cycles, 1)
+        self.assertEqual(result.winners, [imp_])
+        self.assertEqual(result.deaths, [None, 1])
+        self.assertEqual(result.processes, [1, 0])
+        self.assertEqual(self._mars.warriors, [imp_])
+        self.assertTrue(core.STRICT)
+
+    def testRunBattleTie(self):
+        self._mars.load(core.Warrior(imp))
+        self._mars.load(core.Warrior(dwarf), 100)
+        result = self._mars.run_battle(50)
+        self.assertEqual(result.cycles, 50)
+        self.assertEqual(len(result.winners), 2)
+        self.assertEqual(result.deaths, [None, None])
+
+    def testSnapshot(self):
+        # Only the ArrayMemory backend can be snapshotted
+        self.assertRaises(TypeError, self._mars.snapshot)
+        self.assertRaises(TypeError, self._mars.restore, None)
+
+    def testBatchCallbacks(self):
+        batches = []
+        writes = []
+        self._memory.add_callback(batches.append, batch=True)
+        self._memory.add_callback(lambda *args: writes.append(args[0]))
+        imp_ = core.Warrior(imp)
+        self._mars.load(imp_, 10)
+        self.assertEqual(batches, [[(10, 'DAT', 'MOV', imp_)]])
+        mov = core.Warrior('MOV.AB #5, 2')
+        self._mars.load(mov, 100)
+        self._mars.cycle()
+        self._mars.cycle()
+        self.assertEqual(batches[2:],
+                [[(11, 'DAT', 'MOV', imp_), (102, 'DAT', 'DAT', mov)],
+                 [(12, 'DAT', 'MOV', imp_)]])
+
+        # Several writes to the same cell are coalesced
+        self._memory.write(5, core.Instruction.from_string('ADD 1, 1'))
+        self._memory.write(5, B_value=2)
+        self._memory.write(5, core.Instruction.from_string('SUB 1, 1'))
+        self._memory.flush_changes()
+        self.assertEqual(batches[-1], [(5, 'DAT', 'SUB', None)])
+        self.assertEqual(writes.count(5), 3)
+        self._memory.flush_changes()
+        self.assertEqual(len(batches), 5)
+
+        self._memory.remove_callback(batches.append)
+        self._mars.cycle()
+        self.assertEqual(len(batches), 5)
+
+    def testStatistics(self):
+        self.assertEqual(self._mars.statistics, None)
+        imp_ = core.Warrior(imp)
+        self._mars.load(imp_)
+        self._mars.load(core.Warrior(dwarf), 100)
+        statistics = self._mars.enable_statistics(interval=2)
+        for i in range(0, 3):
+            self._mars.cycle()
+        self._mars.run_battle(3)
+        stats = statistics.as_dict
+        self.assertEqual(stats['cycles'], 6)
+        self.assertEqual(len(stats['time']), 3)
+        self.assertEqual(stats['instructions'],
+                {'MOV.I': 6 + 2, 'ADD.AB': 2, 'JMP.B': 2})
+        self.assertEqual([(x['instructions'], x['writes'], x['processes'])
+                          for x in stats['warriors']],
+                         [(6, 6, [1, 1, 1]), (6, 4, [1, 1, 1])])
+        self.assertEqual(json.loads(json.dumps(stats)), stats)
+
+    def testPlace(self):
+        imp_ = core.Warrior(imp)
+        dwarf_ = core.Warrior(dwarf)
+        self._mars.load(imp_)
+        self._mars.run_battle(10)
+        self._mars.place([dwarf_, imp_], (0, 100))
+        self.assertEqual(self._mars.cycles, 0)
+        self.assertEqual(self._mars.warriors, [dwarf_, imp_])
+        self.assertEqual(imp_.threads, [100])
+        self.assertEqual(self._memory.read(5), 'DAT 0, 0')
+        self.assertEqual(self._memory.read(100), imp)
+        first = self._mars.run_battle(50)
+        self._mars.place([dwarf_, imp_], (0, 100))
+        self.assertEqual(self._mars.run_battle(50), first)
+        self.assertRaises(ValueError, self._mars.place, [imp_], (0, 100))
+
+    def testMatch(self):
+        imp_ = core.Warrior(imp)
+        dat_ = core.Warrior('DAT 0, 0')
+        results = list(self._mars.match([dat_, imp_], 10, seed=42))
+        self.assertEqual(len(results), 6)
+        self.assertEqual([x.round for x in results], list(range(0, 6)))
+        self.assertEqual([x.winner for x in results], [imp_] * 6)
+        self.assertEqual(results[0].deaths, [1, None])
+        self.assertEqual(results[-1].scores, [0, 18])
+        self.assertEqual([x.decided for x in results], [False] * 5 + [True])
+        self.assertFalse(any([x.tie for x in results]))
+        results = list(self._mars.match([dat_, imp_], 10, seed=42,
+                                        early_exit=False))
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[-1].scores, [0, 30])
+
+        # Ties at maxcycles
+        self._properties = core.MarsProperties(coresize=200, maxcycles=50)
+        mars = core.Mars(self._properties, self.memory_class)
+        results = list(mars.match([imp_, core.Warrior(imp)], 4, seed=1))
+        self.assertEqual(len(results), 4)
+        self.assertEqual([(x.winner, x.tie, x.cycles, x.deaths)
+                          for x in results],
+                         [(None, True, 50, [None, None])] * 4)
+        self.assertEqual(results[-1].scores, [4, 4])
+        self.assertTrue(results[-1].decided)
+
+    def testPSpace(self):
+        warrior = core.Warrior('''STP.AB #7, #3
+                                  LDP.AB #3, 1
+                                  DAT 0, 0''')
+        self._mars.load(warrior)
+        self.assertEqual(len(warrior.pspace), 500)
+        self.assertEqual(list(warrior.pspace[0:4]), [199, 0, 0, 0])
+        self._mars.run_battle(2)
+        self.assertEqual(list(warrior.pspace[0:4]), [199, 0, 0, 7])
+        self.assertEqual(self._memory.read(2), 'DAT 0, 7')
+
+        # The P-space is carried over between rounds
+        counter = core.Warrior('''LDP.AB #1, $3
+                                  ADD.AB #1, $2
+                                  STP.B  $1, #1
+                                  JMP    $0, $0''')
+        mars = core.Mars(core.MarsProperties(coresize=200, maxcycles=20,
+                                             pspacesize=16),
+                         self.memory_class)
+        results = list(mars.match([counter, core.Warrior(imp)], 5,
+                                  early_exit=False))
+        self.assertEqual(len(results), 5)
+        self.assertEqual(list(counter.pspace[0:2]), [2, 5])
+        self.assertEqual(len(counter.pspace), 16)
+
+class TestMarsArrayMemory(TestMars):
+    memory_class = core.ArrayMemory
+
+    def testSnapshot(self):
+        imp_ = core.Warrior(imp)
+        dwarf_ = core.Warrior(dwarf)
+        self._mars.load(imp_)
+        self._mars.load(dwarf_, 100)
+        self._mars.cycle()
+        snapshot = self._mars.snapshot()
+        cells = [self._memory.read(x).copy() for x in range(0, 200)]
+        first = self._mars.run_battle()
+        self.assertNotEqual(self._mars.cycles, 1)
+
+        self._mars.restore(snapshot)
+        self.assertEqual(self._mars.cycles, 1)
+        self.assertEqual(self._mars.warriors, [imp_, dwarf_])
+        self.assertEqual(imp_.threads, [1])
+        self.assertEqual(dwarf_.threads, [101])
+        self.assertEqual([self._memory.read(x) for x in range(0, 200)], cells)
+        second = self._mars.run_battle()
+        self.assertEqual((first.cycles, first.deaths),
+                (second.cycles, second.deaths))
+
+    def testRestoreCallbacks(self):
+        self._mars.load(core.Warrior(imp))
+        snapshot = self._mars.snapshot()
+        self._mars.cycle()
+        changes = []
+        self._memory.add_callback(lambda ptr, old, new: changes.append(ptr))
+        self._mars.restore(snapshot)
+        self.assertEqual(changes, [1])
+        self.assertEqual(self._memory.read(1), 'DAT 0, 0')
+        self.assertRaises(ValueError, core.Mars(core.MarsProperties(
+            coresize=100), self.memory_class).restore, snapshot)
+
+    def testSnapshotPSpace(self):
+        warrior = core.Warrior('''STP.AB #7, #3
+                                  DAT 0, 0''')
+        self._mars.load(warrior)
+        snapshot = self._mars.snapshot()
+        self._mars.run_battle(1)
+        self.assertEqual(list(warrior.pspace[0:4]), [199, 0, 0, 7])
+        self._mars.restore(snapshot)
+        self.assertEqual(list(warrior.pspace[0:4]), [199, 0, 0, 0])
+
+class TestPlacements(VMarsTestCase):
+    def testFixed(self):
+        placements = core.Placements.fixed(3, self._properties, 2)
+        self.assertEqual(list(placements), [(0, 200, 400)] * 2)
+
+    def testRandom(self):
+        properties = core.MarsProperties(coresize=200, mindistance=20)
+        placements = core.Placements.random(4, properties, 50, seed=42)
+        self.assertEqual(len(placements), 50)
+        self.assertEqual(list(placements),
+                list(core.Placements.random(4, properties, 50, seed=42)))
+        for row in placements:
+            self.assertEqual(row[0], 0)
+            for (x, y) in itertools.combinations(row, 2):
+                self.assertTrue(20 <= (x - y) % 200 <= 180, row)
+        self.assertRaises(ValueError, core.Placements.random, 11,
+                properties, 1)
+
+    def testExhaustive(self):
+        properties = core.MarsProperties(coresize=200, mindistance=20)
+        placements = core.Placements.exhaustive(2, properties)
+        self.assertEqual(list(placements), [(0, x) for x in range(20, 181)])
+        placements = core.Placements.exhaustive(3, properties)
+        self.assertIn((0, 20, 40), list(placements))
+        self.assertIn((0, 160, 180), list(placements))
+        self.assertNotIn((0, 170, 190), list(placements))
+        self.assertEqual(len(core.Placements.exhaustive(10, properties)), 1)
+        self.assertRaises(IndexError, placements.__getitem__, len(placements))
+
+class TestArrayMemory(VMarsTestCase):
+    memory_class = core.ArrayMemory
+
+    def testRead(self):
+        for i in range(0, 10):
+            self.assertEqual(self._memory.read(i),
+                    core.Instruction('DAT', None, '$0', '$0'))
+        self.assertEqual(self._memory.read(1), self._memory.read(201))
+
+    def testWrite(self):
+        inst = core.Instruction('MOV', None, '658', '{47')
+        self._memory.write(5, inst)
+        self.assertEqual(self._memory.read(5), 'MOV $58, {47')
+        self.assertIsNot(self._memory.read(5), inst)
+
+        cell = self._memory.read(5)
+        cell.B_value = 250
+        self.assertEqual(self._memory.read(205).B, '{50')
+
+        self._memory.write(5, B='#3')
+        self.assertEqual(self._memory.read(5), 'MOV $58, #3')
+
+    def testCallback(self):
+        calls = []
+        self._memory.add_callback(lambda *args: calls.append(args))
+        self._memory.write(5, core.Instruction.from_string('MOV 5, 2'))
+        self.assertEqual(calls[0][0], 5)
+        self.assertEqual(calls[0][1], 'DAT 0, 0')
+        self.assertEqual(calls[0][2], 'MOV 5, 2')
+
+    testInPlace = TestMemory.__dict__['testInPlace']
+    testWriteCopies = TestMemory.__dict__['testWriteCopies']
+
+class TestInstructionArrayMemory(TestInstruction):
+    memory_class = core.ArrayMemory
+
+class TestWarriorArrayMemory(TestWarrior):
+    memory_class = core.ArrayMemory
+
+class TestConformanceArrayMemory(TestConformance):
+    memory_class = core.ArrayMemory
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import vmars.core as core
+import vmars.tournament as tournament
+
+imp = 'MOV 0, 1'
+dwarf = '''
+        ADD.AB #4, 3
+        MOV.I  2, @2
+        JMP    -2
+        DAT    #0, #0
+        '''
+dat = 'DAT 0, 0'
+
+class TestTournament(unittest.TestCase):
+    def setUp(self):
+        self._properties = core.MarsProperties(coresize=400, maxcycles=2000,
+                mindistance=50)
+        self._warriors = [('imp', imp), ('dwarf', dwarf), ('dat', dat)]
+
+    def testSchedule(self):
+        t1 = tournament.Tournament(self._warriors, self._properties, 10, 42)
+        t2 = tournament.Tournament(self._warriors, self._properties, 10, 42)
+        self.assertEqual(t1.schedule(), t2.schedule())
+        self.assertEqual(len(t1.schedule()), 3*10)
+        for (i, j, offset) in t1.schedule():
+            self.assertTrue(50 <= offset <= 350)
+
+    def testRun(self):
+        t = tournament.Tournament(self._warriors, self._properties, 4, 42)
+        results = t.run(1)
+        self.assertEqual(results, t.run(2))
+        self.assertEqual(results['dat']['wins'], 0)
+        self.assertEqual(results['dat']['losses'], 8)
+        self.assertEqual(sum([x['wins'] for x in results.values()]),
+                sum([x['losses'] for x in results.values()]))
+
+    def testRunBattle(self):
+        properties = self._properties.as_dict
+        for i in range(0, 2):
+            self.assertEqual(tournament.run_battle((dwarf, dat), (0, 200),
+                properties), [0])
+            self.assertEqual(tournament.run_battle((dat, imp), (0, 200),
+                properties), [1])
+            self.assertEqual(tournament.run_battle((imp, dwarf), (0, 200),
+                properties), [0, 1])
+        self.assertEqual(len([x for x in tournament._mars.values()
+                              if x.properties.coresize == 400]), 1)
+
+    def testLoadDirectory(self):
+        path = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(path, 'imp.red'), 'w') as fd:
+                fd.write('imp MOV imp, imp+1')
+            with open(os.path.join(path, 'dwarf.rc'), 'w') as fd:
+                fd.write(dwarf)
+            with open(os.path.join(path, 'README'), 'w') as fd:
+                fd.write('foo')
+            warriors = tournament.load_directory(path, self._properties)
+        finally:
+            shutil.rmtree(path)
+        self.assertEqual([name for (name, program) in warriors],
+                ['dwarf', 'imp'])
+        self.assertEqual(core.Warrior(warriors[1][1]),
+                core.Warrior(imp))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import vmars.core as core
+import vmars.tracing as tracing
+
+dwarf = '''
+        ADD.AB #4, 3
+        MOV.I  2, @2
+        JMP    -2
+        DAT    #0, #0
+        '''
+mice = '''
+        ORG 1
+        DAT    #0, #0
+        MOV    #12, -1
+        MOV    @-2, <5
+        DJN    -1, -3
+        SPL    @3
+        ADD    #653, 2
+        JMZ    -5, -6
+        DAT    #0, #833
+        '''
+
+class TestTracing(unittest.TestCase):
+    memory_class = core.Memory
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._properties = core.MarsProperties(coresize=200, maxcycles=300)
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def memory(self, memory):
+        return [memory.read(x).copy() for x in range(0, memory.size)]
+
+    def testReplay(self):
+        mars = core.Mars(self._properties, self.memory_class)
+        warriors = [core.Warrior(dwarf), core.Warrior(mice)]
+        mars.load(warriors[0], 0)
+        mars.load(warriors[1], 100)
+        path = os.path.join(self._path, 'trace')
+        states = [(self.memory(mars.memory), [list(x.threads) for x in warriors])]
+        with open(path, 'wb') as fd:
+            recorder = tracing.TraceRecorder(mars, fd)
+            for i in range(0, 40):
+                mars.cycle()
+                states.append((self.memory(mars.memory),
+                               [list(x.threads) for x in warriors]))
+            mars.run_battle(20)
+            recorder.close()
+        final = self.memory(mars.memory)
+
+        with tracing.Replay(path) as replay:
+            self.assertEqual(replay.cycles, 60)
+            step = replay.get_step(0)
+            self.assertEqual((step.warrior, step.pc, step.opcode,
+                              step.modifier), (0, 0, 'ADD', 'AB'))
+            self.assertEqual(step.changes[0][0:1], (3,))
+            for cycle in [40, 3, 0, 17, 39, 1]:
+                replay.seek_cycle(cycle)
+                self.assertEqual(replay.cycle, cycle)
+                self.assertEqual(self.memory(replay), states[cycle][0])
+                self.assertEqual([replay.threads(x) for x in (0, 1)],
+                                 states[cycle][1])
+            replay.seek(len(replay))
+            self.assertEqual(self.memory(replay), final)
+            self.assertRaises(tracing.TraceError, replay.forward)
+            replay.seek(0)
+            self.assertEqual(self.memory(replay), states[0][0])
+            self.assertRaises(tracing.TraceError, replay.backward)
+
+            # Cells read are computed from the memory before the step
+            self.assertEqual(replay.get_step(0).reads, None)
+            self.assertEqual(replay.forward().reads, [0, 3])
+            replay.seek(2)
+            self.assertEqual(replay.forward().reads, [1, 3, 7])
+            self.assertEqual(replay.backward().reads, [1, 3, 7])
+
+        # Recording stopped
+        mars.cycle()
+        self.assertEqual(mars.memory._journal, None)
+
+class TestTracingArrayMemory(TestTracing):
+    memory_class = core.ArrayMemory
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import random
+import unittest
+
+import vmars.core as core
+try:
+    import vmars.vector as vector
+except ImportError: # NumPy is not installed
+    vector = None
+
+imp = 'MOV 0, 1'
+dwarf = '''
+        ADD.AB #4, 3
+        MOV.I  2, @2
+        JMP    -2
+        DAT    #0, #0
+        '''
+mice = '''
+        ORG 1
+        DAT    #0, #0
+        MOV    #12, -1
+        MOV    @-2, <5
+        DJN    -1, -3
+        SPL    @3
+        ADD    #653, 2
+        JMZ    -5, -6
+        DAT    #0, #833
+        '''
+scanner = '''
+        ADD.F  #7, }4
+        CMP.I  }3, >3
+        SLT.AB #2, 2
+        MOD.X  #5, 1
+        JMN.F  -4, {1
+        DIV.BA #3, <1
+        SUB.X  *-2, @-1
+        MUL.I  $2, $-3
+        SEQ.X  #1, *1
+        MOV.X  {-1, }-2
+        DJN.F  -10, #3
+        SPL    -11, >-1
+        '''
+# Silk-style paper, which relies on the registers being copied before the
+# postincrements
+paper = '''
+        SPL    @0, >137
+        MOV.I  }-1, >-1
+        MOV.I  }-2, >-2
+        JMP    -3
+        '''
+
+@unittest.skipIf(vector is None, 'NumPy is not installed.')
+class TestVectorMars(unittest.TestCase):
+    def setUp(self):
+        self._properties = core.MarsProperties(coresize=400, maxcycles=1500,
+                maxprocesses=64, mindistance=20)
+        self._offsets = range(20, 380, 15)
+
+    def assertSameBattles(self, programs):
+        mars = vector.VectorMars(self._properties, len(self._offsets))
+        warriors = [core.Warrior(x) for x in programs]
+        mars.load(warriors[0], [0] * len(self._offsets))
+        mars.load(warriors[1], self._offsets)
+        results = mars.run_battles()
+        for (battle, offset) in enumerate(self._offsets):
+            reference = core.Mars(self._properties)
+            reference_warriors = [core.Warrior(x) for x in programs]
+            reference.load(reference_warriors[0], 0)
+            reference.load(reference_warriors[1], offset)
+            expected = reference.run_battle()
+            result = results[battle]
+            self.assertEqual(result.cycles, expected.cycles)
+            self.assertEqual(result.deaths, expected.deaths)
+            self.assertEqual(result.processes, expected.processes)
+            for i in (0, 1):
+                self.assertEqual(mars.threads(battle, i),
+                        list(reference_warriors[i].threads))
+                self.assertEqual(mars.pspace(battle, i),
+                        list(reference_warriors[i].pspace))
+            for ptr in range(0, self._properties.coresize):
+                self.assertEqual(mars.read(battle, ptr),
+                        reference.memory.read(ptr))
+
+    def testImpDwarf(self):
+        self.assertSameBattles([imp, dwarf])
+
+    def testDwarfMice(self):
+        self.assertSameBattles([dwarf, mice])
+
+    def testScanner(self):
+        self.assertSameBattles([scanner, dwarf])
+        self.assertSameBattles([mice, scanner])
+
+    def testPaper(self):
+        self.assertSameBattles([paper, dwarf])
+
+    def testRandom(self):
+        rand = random.Random(42)
+        opcodes = [x for x in core.SYNTAX.opcodes if x != 'DAT']
+        def random_warrior():
+            # SPL 0 keeps the warrior alive, so the random code runs many
+            # times.
+            return 'SPL 0\n' + '\n'.join(['%s.%s %s%i, %s%i' % (
+                    rand.choice(opcodes),
+                    rand.choice(core.SYNTAX.modifiers),
+                    rand.choice(core.SYNTAX.addressing), rand.randint(-20, 20),
+                    rand.choice(core.SYNTAX.addressing), rand.randint(-20, 20))
+                for i in range(0, 10)])
+        for i in range(0, 8):
+            self.assertSameBattles([random_warrior(), random_warrior()])
+
+
+if __name__ == '__main__':
+    unittest.main()